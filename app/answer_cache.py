@@ -0,0 +1,140 @@
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from settings import settings
+
+
+def doc_signature(doc_ids: Sequence[str]) -> str:
+    """Empreinte de l'ensemble des passages récupérés (ordre indifférent)."""
+    return hashlib.sha256("\n".join(sorted(doc_ids)).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _Entry:
+    project: str
+    vector: np.ndarray  # question normalisée (norme 1)
+    signature: str
+    answer: str
+    created_at: float
+
+
+class AnswerCache:
+    """
+    Cache sémantique des réponses, par projet.
+    Une réponse est réutilisée si, pour le même projet :
+    - la question est assez proche (cosinus >= threshold entre embeddings)
+    - les passages récupérés sont les mêmes (doc_signature)
+    - l'entrée n'a pas expiré (ttl_s, 0 = jamais)
+    Borné à max_entries (LRU global) ; invalidate(project) vide un projet,
+    par exemple quand une ingestion a modifié ses chunks.
+    La clé ne porte pas la mémoire de session : l'appelant ne cherche et ne
+    stocke que des réponses dont le prompt n'en contient pas, partageables
+    entre sessions.
+    """
+
+    def __init__(
+        self, max_entries: int = 2048, ttl_s: float = 86400, threshold: float = 0.95
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._by_project: Dict[str, List[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_project[entry.project]
+        ids.remove(entry_id)
+        if not ids:
+            del self._by_project[entry.project]
+
+    def lookup(
+        self, project: str, vector: Sequence[float], signature: str
+    ) -> Optional[str]:
+        q = _unit(vector)
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_project.get(project, [])):
+                entry = self._entries[entry_id]
+                if self.ttl_s > 0 and now - entry.created_at > self.ttl_s:
+                    self._drop(entry_id)
+                elif entry.signature == signature:
+                    candidates.append(entry_id)
+            if candidates:
+                sims = np.stack([self._entries[i].vector for i in candidates]) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self._entries.move_to_end(candidates[best])
+                    self.hits += 1
+                    return self._entries[candidates[best]].answer
+            self.misses += 1
+            return None
+
+    def store(self, project: str, vector: Sequence[float], signature: str, answer: str):
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = _Entry(
+                project, _unit(vector), signature, answer, time.time()
+            )
+            self._by_project.setdefault(project, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, project: str) -> int:
+        with self._lock:
+            ids = list(self._by_project.get(project, []))
+            for entry_id in ids:
+                self._drop(entry_id)
+            self.invalidations += 1
+            return len(ids)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "projects": len(self._by_project),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+            }
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Cache partagé du process ; None si ANSWER_CACHE_SIZE vaut 0."""
+    global _cache
+    if settings.answer_cache_size <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(
+                max_entries=settings.answer_cache_size,
+                ttl_s=settings.answer_cache_ttl_s,
+                threshold=settings.answer_cache_threshold,
+            )
+        return _cache
@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from settings import settings
+
+# Types acceptés (le modèle ne lit que des images) → extension du blob
+MIME_EXT: Dict[str, str] = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+EXT_MIME = {ext: mime for mime, ext in MIME_EXT.items()}
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class AttachmentError(ValueError):
+    """Pièce jointe refusée (type, taille) ou identifiant invalide."""
+
+
+@dataclass
+class Attachment:
+    id: str
+    mime: str
+    size: int
+    path: str
+
+
+class AttachmentStore:
+    """
+    Store local de pièces jointes adressé par contenu.
+    - identifiant = sha256 du contenu : un même fichier n'est stocké qu'une fois
+    - blobs rangés en <root>/<2 premiers hex>/<sha256>.<ext>
+    - mtime = dernier usage (upload ou lecture) ; gc() purge au-delà de ttl_days
+      puis les moins récemment utilisés tant que le total dépasse max_total_bytes
+
+    Utilisation :
+        store = AttachmentStore("/data/attachments")
+        att = store.put(data, "image/png")       # -> Attachment(id=<sha256>, ...)
+        store.data_url(att.id)                   # "data:image/png;base64,..."
+    """
+
+    # GC automatique tous les N ajouts (coût amorti)
+    GC_EVERY = 100
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = 10 * 1024 * 1024,
+        max_total_bytes: int = 2 * 1024**3,
+        ttl_days: float = 30,
+    ):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl_days = ttl_days
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def _path(self, att_id: str, ext: str) -> str:
+        return os.path.join(self.root, att_id[:2], f"{att_id}.{ext}")
+
+    def put(self, data: bytes, mime: str) -> Attachment:
+        mime = (mime or "").split(";")[0].strip().lower()
+        if mime not in MIME_EXT:
+            raise AttachmentError(f"Type non supporté: {mime or 'inconnu'}")
+        if not data:
+            raise AttachmentError("Pièce jointe vide")
+        if len(data) > self.max_bytes:
+            raise AttachmentError(f"Pièce jointe > {self.max_bytes} octets")
+        att_id = hashlib.sha256(data).hexdigest()
+        path = self._path(att_id, MIME_EXT[mime])
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Écriture atomique : un lecteur ne voit jamais un blob partiel
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        with self._lock:
+            self._puts += 1
+            run_gc = self._puts % self.GC_EVERY == 0
+        if run_gc:
+            self.gc()
+        return Attachment(id=att_id, mime=mime, size=len(data), path=path)
+
+    def get(self, att_id: str) -> Optional[Attachment]:
+        if not _ID_RE.match(att_id or ""):
+            raise AttachmentError(f"Identifiant invalide: {att_id!r}")
+        for ext, mime in EXT_MIME.items():
+            path = self._path(att_id, ext)
+            if os.path.exists(path):
+                return Attachment(
+                    id=att_id, mime=mime, size=os.path.getsize(path), path=path
+                )
+        return None
+
+    def data_url(self, att_id: str) -> Optional[str]:
+        """Contenu encodé pour l'API du modèle ; marque le blob comme utilisé."""
+        att = self.get(att_id)
+        if att is None:
+            return None
+        with open(att.path, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode("ascii")
+        os.utime(att.path)
+        return f"data:{att.mime};base64,{b64}"
+
+    def _blobs(self) -> List[Tuple[float, int, str]]:
+        out = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def gc(self) -> Dict[str, int]:
+        """Purge les blobs expirés, puis les plus anciens au-delà du quota."""
+        now = time.time()
+        removed = freed = 0
+        blobs = sorted(self._blobs())
+        total = sum(size for _, size, _ in blobs)
+        for mtime, size, path in blobs:
+            expired = self.ttl_days > 0 and now - mtime > self.ttl_days * 86400
+            # Fichiers .tmp orphelins (écriture interrompue) : purgés après 1h
+            stale_tmp = path.endswith(".tmp") and now - mtime > 3600
+            if not (expired or stale_tmp or total > self.max_total_bytes):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += size
+            total -= size
+        return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+
+_store: Optional[AttachmentStore] = None
+_store_lock = threading.Lock()
+
+
+def get_attachment_store() -> AttachmentStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AttachmentStore(
+                settings.attachments_dir,
+                max_bytes=settings.attachments_max_bytes,
+                max_total_bytes=settings.attachments_max_total_bytes,
+                ttl_days=settings.attachments_ttl_days,
+            )
+        return _store
+
+
+if __name__ == "__main__":
+    # python attachments.py gc
+    import sys
+
+    if sys.argv[1:] != ["gc"]:
+        sys.exit("usage: attachments.py gc")
+    print(get_attachment_store().gc())
@@ -0,0 +1,200 @@
+"""
+Rapport rappel / latence des options de stockage Qdrant sur un corpus local.
+
+    python bench_qdrant.py [project] [--queries N] [--top-k K] [--keep]
+
+Les vecteurs du projet sont relus depuis sa collection (aucun appel API) et
+rechargés dans des collections temporaires bench__<config>. La vérité terrain
+est une recherche exacte float32 pleine dimension. Les dimensions réduites sont
+simulées par troncature + renormalisation, équivalentes au paramètre
+`dimensions` des modèles text-embedding-3.
+"""
+
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from ingest_docs import quantization_config
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    Distance,
+    PointStruct,
+    QuantizationSearchParams,
+    SearchParams,
+    VectorParams,
+)
+from retriever import collection_for
+from settings import settings
+
+
+@dataclass(frozen=True)
+class BenchConfig:
+    name: str
+    dim: Optional[int] = None  # None = pleine dimension
+    quantization: str = "none"
+    on_disk: bool = False
+    oversampling: Optional[float] = None
+    rescore: bool = True
+
+    @property
+    def storage(self) -> Tuple[Optional[int], str, bool]:
+        return self.dim, self.quantization, self.on_disk
+
+
+CONFIGS = [
+    BenchConfig("float32"),
+    BenchConfig("scalar", quantization="scalar", rescore=False),
+    BenchConfig("scalar+rescore", quantization="scalar", oversampling=1.5),
+    BenchConfig(
+        "scalar+disk+rescore", quantization="scalar", on_disk=True, oversampling=2.0
+    ),
+    BenchConfig("binary", quantization="binary", rescore=False),
+    BenchConfig("binary+rescore x2", quantization="binary", oversampling=2.0),
+    BenchConfig(
+        "binary+disk+rescore x4", quantization="binary", on_disk=True, oversampling=4.0
+    ),
+    BenchConfig("dim512", dim=512),
+    BenchConfig(
+        "dim512+scalar+rescore", dim=512, quantization="scalar", oversampling=1.5
+    ),
+]
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+
+def _ram_bytes_per_vector(c: BenchConfig, full_dim: int) -> float:
+    dim = c.dim or full_dim
+    quantized = {"none": 0.0, "scalar": dim, "binary": dim / 8}[c.quantization]
+    originals = 0.0 if c.on_disk else 4.0 * dim
+    return quantized + originals
+
+
+def load_corpus(client: QdrantClient, project: str) -> Tuple[List, np.ndarray]:
+    ids, vectors, offset = [], [], None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_for(project),
+            limit=512,
+            offset=offset,
+            with_payload=["project"],
+            with_vectors=True,
+        )
+        for r in records:
+            if (r.payload or {}).get("project") == project:
+                ids.append(r.id)
+                vectors.append(r.vector)
+        if offset is None:
+            break
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def _build(
+    client: QdrantClient, name: str, ids: List, vectors: np.ndarray, c: BenchConfig
+):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(
+            size=vectors.shape[1], distance=Distance.COSINE, on_disk=c.on_disk
+        ),
+        quantization_config=quantization_config(c.quantization),
+    )
+    for i in range(0, len(ids), 256):
+        client.upsert(
+            collection_name=name,
+            points=[
+                PointStruct(id=pid, vector=v.tolist())
+                for pid, v in zip(ids[i : i + 256], vectors[i : i + 256])
+            ],
+        )
+    # Attente de la fin de l'indexation (HNSW + quantification)
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if client.get_collection(name).status.value == "green":
+            break
+        time.sleep(0.5)
+
+
+def run(project: str, n_queries: int, top_k: int, keep: bool) -> Tuple[List[Dict], int]:
+    client = QdrantClient(url=settings.qdrant_url)
+    ids, corpus = load_corpus(client, project)
+    if not ids:
+        raise SystemExit(f"Aucun point pour project={project}")
+    corpus = _normalize(corpus)
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+    # Requêtes proches mais distinctes des chunks du corpus
+    noise = rng.normal(0, 0.02, corpus[picks].shape).astype(np.float32)
+    queries = _normalize(corpus[picks] + noise)
+    full_dim = corpus.shape[1]
+    # Vérité terrain : top_k exact en cosinus, pleine dimension
+    truth = [{ids[i] for i in np.argsort(-(corpus @ q))[:top_k]} for q in queries]
+
+    built: Dict[Tuple, str] = {}
+    rows = []
+    for c in CONFIGS:
+        dim = c.dim or full_dim
+        if c.storage not in built:
+            built[c.storage] = f"bench__{len(built)}"
+            _build(client, built[c.storage], ids, _normalize(corpus[:, :dim]), c)
+        quantization = None
+        if c.quantization != "none":
+            quantization = QuantizationSearchParams(
+                rescore=c.rescore, oversampling=c.oversampling
+            )
+        params = SearchParams(quantization=quantization)
+
+        latencies, recalls = [], []
+        for q, expected in zip(_normalize(queries[:, :dim]), truth):
+            started = time.perf_counter()
+            hits = client.search(
+                collection_name=built[c.storage],
+                query_vector=q.tolist(),
+                limit=top_k,
+                search_params=params,
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len({h.id for h in hits} & expected) / top_k)
+        latencies.sort()
+        rows.append(
+            {
+                "config": c.name,
+                "recall": statistics.mean(recalls),
+                "p50_ms": latencies[len(latencies) // 2],
+                "p95_ms": latencies[max(0, int(len(latencies) * 0.95) - 1)],
+                "ram_mb": _ram_bytes_per_vector(c, full_dim) * len(ids) / 1e6,
+            }
+        )
+
+    if not keep:
+        for name in built.values():
+            client.delete_collection(name)
+    return rows, len(ids)
+
+
+def print_report(rows: List[Dict], n_points: int, top_k: int):
+    print(f"\nRappel@{top_k} vs recherche exacte float32 — {n_points} points")
+    print(f"{'config':<26}{'rappel':>8}{'p50 ms':>9}{'p95 ms':>9}{'RAM vect. MB':>14}")
+    for r in rows:
+        print(
+            f"{r['config']:<26}{r['recall']:>8.3f}{r['p50_ms']:>9.2f}"
+            f"{r['p95_ms']:>9.2f}{r['ram_mb']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    def _opt(flag: str, default: int) -> int:
+        return int(args[args.index(flag) + 1]) if flag in args else default
+
+    project = args[0] if args and not args[0].startswith("--") else "default"
+    top_k = _opt("--top-k", 5)
+    rows, n_points = run(project, _opt("--queries", 100), top_k, keep="--keep" in args)
+    print_report(rows, n_points, top_k)
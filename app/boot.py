@@ -0,0 +1,9 @@
+"""
+Premier module importé par main.py (avant toute autre dépendance) : date le
+début de l'import de l'application. on_startup compare cette date à son
+propre début pour rapporter import_s (/ready, /health, log de démarrage).
+"""
+
+import time
+
+IMPORT_STARTED = time.perf_counter()
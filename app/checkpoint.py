@@ -0,0 +1,196 @@
+import logging
+import os
+from contextlib import AsyncExitStack
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import psycopg
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from metrics import span
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+# Options exigées par les savers LangGraph : autocommit (setup() crée des index
+# en CONCURRENTLY), pas de requêtes préparées (compatibles pgbouncer), lignes en dict
+_CONN_KWARGS: Dict[str, Any] = {
+    "autocommit": True,
+    "prepare_threshold": 0,
+    "row_factory": dict_row,
+}
+
+# Pools du process, ouverts une fois pour toute la durée de vie de l'app
+_async_pool: Optional[AsyncConnectionPool] = None
+_sync_pool: Optional[ConnectionPool] = None
+
+
+class TimedAsyncPostgresSaver(AsyncPostgresSaver):
+    """AsyncPostgresSaver dont les lectures/écritures sont mesurées (span "checkpoint")."""
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with span("checkpoint", "get"):
+            return await super().aget_tuple(config)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with span("checkpoint", "put"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        with span("checkpoint", "put_writes"):
+            await super().aput_writes(config, writes, task_id, task_path)
+
+
+def _env(key: str, default: Optional[str] = None) -> Optional[str]:
+    val = getattr(settings, key.lower(), None)
+    return val or os.getenv(key, default)
+
+
+def redact_dsn(dsn: str) -> str:
+    try:
+        if "://" in dsn and "@" in dsn:
+            scheme, rest = dsn.split("://", 1)
+            userpass, host = rest.split("@", 1)
+            user = userpass.split(":")[0]
+            return f"{scheme}://{user}:***@{host}"
+    except Exception:
+        pass
+    return dsn
+
+
+def resolve_pg_dsn() -> str:
+    """DSN du checkpointer : CHECKPOINT_PG_DSN, POSTGRES_DSN, sinon POSTGRES_*."""
+    dsn = _env("CHECKPOINT_PG_DSN") or _env("POSTGRES_DSN")
+    if dsn:
+        return dsn
+    user = _env("POSTGRES_USER", "zep")
+    pwd = _env("POSTGRES_PASSWORD", "zep_password")
+    db = _env("POSTGRES_DB", "zep")
+    host = _env("POSTGRES_HOST", "db")
+    port = _env("POSTGRES_PORT", "5432")
+    return f"postgresql://{user}:{pwd}@{host}:{port}/{db}?sslmode=disable"
+
+
+async def open_async_checkpointer(
+    stack: AsyncExitStack, dsn: Optional[str] = None
+) -> AsyncPostgresSaver:
+    """
+    Ouvre le pool async partagé et retourne un AsyncPostgresSaver adossé à ce
+    pool (tables créées/migrées par setup()). La fermeture du pool est
+    enregistrée dans stack : l'appelant le ferme à l'arrêt de l'app.
+    """
+    global _async_pool
+    dsn = dsn or resolve_pg_dsn()
+    pool = AsyncConnectionPool(
+        conninfo=dsn,
+        min_size=settings.checkpoint_pool_min_size,
+        max_size=settings.checkpoint_pool_max_size,
+        timeout=settings.checkpoint_pool_timeout_s,
+        kwargs=_CONN_KWARGS,
+        open=False,
+        name="checkpoint",
+    )
+    try:
+        await pool.open(wait=True, timeout=settings.checkpoint_pool_timeout_s)
+    except Exception:
+        await pool.close()
+        raise
+    stack.push_async_callback(_close_async_pool, pool)
+    _async_pool = pool
+    saver = TimedAsyncPostgresSaver(pool)  # type: ignore[arg-type]
+    await saver.setup()
+    log.info(
+        "Pool checkpoint ouvert (%s, min=%d, max=%d)",
+        redact_dsn(dsn),
+        pool.min_size,
+        pool.max_size,
+    )
+    return saver
+
+
+async def _close_async_pool(pool: AsyncConnectionPool):
+    global _async_pool
+    await pool.close()
+    if _async_pool is pool:
+        _async_pool = None
+
+
+def open_checkpointer(dsn: Optional[str] = None) -> PostgresSaver:
+    """
+    Variante synchrone (scripts, graphes invoqués hors boucle asyncio) :
+    pool ouvert une fois par process, fermé par close_checkpointer().
+    """
+    global _sync_pool
+    if _sync_pool is None:
+        pool = ConnectionPool(
+            conninfo=dsn or resolve_pg_dsn(),
+            min_size=settings.checkpoint_pool_min_size,
+            max_size=settings.checkpoint_pool_max_size,
+            timeout=settings.checkpoint_pool_timeout_s,
+            kwargs=_CONN_KWARGS,
+            open=False,
+            name="checkpoint-sync",
+        )
+        try:
+            pool.open(wait=True, timeout=settings.checkpoint_pool_timeout_s)
+        except Exception:
+            pool.close()
+            raise
+        _sync_pool = pool
+    saver = PostgresSaver(_sync_pool)  # type: ignore[arg-type]
+    saver.setup()
+    return saver
+
+
+def close_checkpointer():
+    global _sync_pool
+    if _sync_pool is not None:
+        _sync_pool.close()
+        _sync_pool = None
+
+
+async def aping(dsn: Optional[str] = None) -> bool:
+    """SELECT 1 via le pool async s'il est ouvert, sinon par une connexion directe."""
+    try:
+        if _async_pool is not None:
+            async with _async_pool.connection(
+                timeout=settings.checkpoint_pool_timeout_s
+            ) as conn:
+                await conn.execute("SELECT 1")
+        else:
+            async with await psycopg.AsyncConnection.connect(
+                dsn or resolve_pg_dsn(), connect_timeout=3
+            ) as conn:
+                await conn.execute("SELECT 1")
+        return True
+    except Exception as e:
+        log.error("❌ Postgres ping KO: %s", e)
+        return False
+
+
+def pool_stats() -> Dict[str, Optional[Dict[str, int]]]:
+    """Compteurs psycopg_pool (taille, connexions libres, attentes, erreurs)."""
+    return {
+        "async": _async_pool.get_stats() if _async_pool is not None else None,
+        "sync": _sync_pool.get_stats() if _sync_pool is not None else None,
+    }
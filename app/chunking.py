@@ -0,0 +1,283 @@
+"""
+Découpage des documents en chunks selon leur format.
+
+Chaque stratégie (par suffixe) découpe le texte en unités structurelles :
+sections Markdown, définitions Python de premier niveau, entrées de log,
+paragraphes. Les unités sont ensuite regroupées ou redécoupées à une taille
+mesurée en tokens (modèle d'embeddings), avec un recouvrement entre chunks
+consécutifs d'un même segment : la fin du chunk précédent, bornée en tokens.
+
+    chunks = chunk_text(texte, ".md")   # -> List[TextChunk]
+
+CHUNKER_VERSION change quand le découpage change : l'ingestion rechunke alors
+tout le projet (les embeddings des textes inchangés restent dans le store).
+"""
+
+import ast
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from context_budget import count_tokens
+from settings import settings
+
+CHUNKER_VERSION = 4
+
+# Début d'une entrée de log : date ISO, heure, ou date syslog ("Mar  3 ...")
+_LOG_ENTRY_RE = re.compile(
+    r"^\s*(\[?\d{4}-\d{2}-\d{2}|\[?\d{2}:\d{2}:\d{2}|[A-Z][a-z]{2} [ \d]\d )"
+)
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_MD_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+
+@dataclass(frozen=True)
+class TextChunk:
+    text: str
+    start: int  # offsets en caractères dans le texte décodé du fichier
+    end: int
+    section: Optional[str] = None  # titres Markdown "H1 > H2"
+    symbol: Optional[str] = None  # définition Python (classe, fonction)
+
+    def metadata(self) -> Dict[str, object]:
+        meta: Dict[str, object] = {"start": self.start, "end": self.end}
+        if self.section:
+            meta["section"] = self.section
+        if self.symbol:
+            meta["symbol"] = self.symbol
+        return meta
+
+
+# Unité : (offset de début, texte) ; les unités d'un segment sont contiguës
+Unit = Tuple[int, str]
+
+
+@dataclass
+class _Segment:
+    units: List[Unit]
+    section: Optional[str] = None
+    symbol: Optional[str] = None
+
+
+def _tokens(text: str) -> int:
+    return count_tokens(text, settings.chunk_token_model)
+
+
+def _lines(text: str, base: int = 0) -> List[Unit]:
+    out, pos = [], 0
+    for line in text.splitlines(keepends=True):
+        out.append((base + pos, line))
+        pos += len(line)
+    return out
+
+
+def _paragraphs(text: str, base: int = 0) -> List[Unit]:
+    """Paragraphes (séparés par des lignes vides), lignes vides incluses."""
+    out: List[Unit] = []
+    start, buf = base, ""
+    for off, line in _lines(text, base):
+        if not line.strip() and buf.strip():
+            out.append((start, buf + line))
+            start, buf = off + len(line), ""
+        else:
+            buf += line
+    if buf:
+        out.append((start, buf))
+    return out
+
+
+def _split_oversized(unit: Unit, max_tokens: int) -> List[Unit]:
+    """
+    Unité plus grande que le budget (ligne géante) : découpe par lignes, puis
+    en morceaux d'au plus max_tokens tokens.
+    """
+    off, text = unit
+    if _tokens(text) <= max_tokens:
+        return [unit]
+    lines = _lines(text, off)
+    if len(lines) > 1:
+        return [u for line in lines for u in _split_oversized(line, max_tokens)]
+    out: List[Unit] = []
+    pos = 0
+    while pos < len(text):
+        rest = text[pos:]
+        n = _fit_prefix(rest, max_tokens)
+        if n < len(rest):
+            # Coupe sur un espace si elle ne sacrifie pas plus de la moitié du morceau
+            cut = rest.rfind(" ", 0, n) + 1
+            if cut > n // 2:
+                n = cut
+        out.append((off + pos, rest[:n]))
+        pos += n
+    return out
+
+
+def _longest(hi: int, fits: Callable[[int], bool]) -> int:
+    """Plus grand n de [0, hi] tel que fits(n), fits étant vraie jusqu'à un seuil."""
+    if fits(hi):
+        return hi
+    lo, hi = 0, hi - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _fit_prefix(text: str, max_tokens: int) -> int:
+    """
+    Longueur (en caractères) du plus long préfixe de text tenant dans
+    max_tokens, par dichotomie sur le décompte réel : CJK, code ou base64
+    comptent bien moins de 4 caractères par token. Au moins 1 caractère.
+    """
+    # Un token dépasse rarement 16 caractères : borne la taille des préfixes comptés
+    hi = min(len(text), max(1, max_tokens) * 16)
+    return max(1, _longest(hi, lambda n: _tokens(text[:n]) <= max_tokens))
+
+
+def _tail(text: str, max_tokens: int) -> str:
+    """
+    Fin de text d'au plus max_tokens tokens, commençant sur un début de mot
+    si cela en garde au moins la moitié.
+    """
+    if max_tokens <= 0:
+        return ""
+    hi = min(len(text), max_tokens * 16)
+    n = _longest(hi, lambda k: _tokens(text[len(text) - k :]) <= max_tokens)
+    tail = text[len(text) - n :]
+    if n < len(text) and not text[len(text) - n - 1].isspace():
+        space = re.search(r"\s", tail)
+        if space and len(tail) - space.end() >= n // 2:
+            tail = tail[space.end() :]
+    return tail
+
+
+def _pack(
+    units: List[Unit], max_tokens: int, overlap_tokens: int
+) -> Iterator[Tuple[int, str]]:
+    """
+    Regroupe des unités contiguës en chunks d'au plus max_tokens. Chaque
+    chunk reprend en tête la fin du précédent (overlap_tokens au plus, et au
+    plus la moitié du budget) : une tranche de caractères, pas des unités
+    entières, si bien que les longs paragraphes et les morceaux de lignes
+    géantes se recouvrent aussi.
+    """
+    overlap = max(0, min(overlap_tokens, max_tokens // 2))
+    # Morceaux de max_tokens - overlap : la reprise tient toujours devant eux
+    units = [u for unit in units for u in _split_oversized(unit, max_tokens - overlap)]
+    sizes = [_tokens(text) for _, text in units]
+    i, tail = 0, ""
+    while i < len(units):
+        used = _tokens(tail) if tail else 0
+        j = i
+        while j < len(units) and (j == i or used + sizes[j] <= max_tokens):
+            used += sizes[j]
+            j += 1
+        body = tail + "".join(text for _, text in units[i:j])
+        # Unités contiguës : la reprise commence juste avant units[i]
+        yield units[i][0] - len(tail), body
+        if j >= len(units):
+            break
+        tail = _tail(body, min(overlap, max_tokens - sizes[j]))
+        i = j
+
+
+def _segments_text(text: str) -> List[_Segment]:
+    return [_Segment(_paragraphs(text))]
+
+
+def _segments_markdown(text: str) -> List[_Segment]:
+    segments: List[_Segment] = []
+    path: List[Tuple[int, str]] = []
+    start, in_fence = 0, False
+    section: Optional[str] = None
+    for off, line in _lines(text):
+        if _MD_FENCE_RE.match(line):
+            in_fence = not in_fence
+        m = None if in_fence else _MD_HEADING_RE.match(line)
+        if m and off > start:
+            segments.append(_Segment(_paragraphs(text[start:off], start), section))
+        if m:
+            level = len(m.group(1))
+            path = [(lvl, title) for lvl, title in path if lvl < level]
+            path.append((level, m.group(2)))
+            section = " > ".join(title for _, title in path)
+            start = off
+    if start < len(text):
+        segments.append(_Segment(_paragraphs(text[start:], start), section))
+    return segments
+
+
+def _segments_python(text: str) -> List[_Segment]:
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return _segments_text(text)
+    lines = _lines(text)
+    segments: List[_Segment] = []
+    cursor = 0  # index de ligne (0-based) du début de la zone non couverte
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        first = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+        last = node.end_lineno or node.lineno
+        if first > cursor:
+            # Code de module entre deux définitions (imports, constantes)
+            segments.append(_Segment(lines[cursor:first]))
+        segments.append(_Segment(lines[first:last], symbol=node.name))
+        cursor = last
+    if cursor < len(lines):
+        segments.append(_Segment(lines[cursor:]))
+    return segments
+
+
+def _segments_log(text: str) -> List[_Segment]:
+    """Une entrée = une ligne horodatée et ses lignes de suite (stack traces)."""
+    entries: List[Unit] = []
+    for off, line in _lines(text):
+        if entries and not _LOG_ENTRY_RE.match(line):
+            start, buf = entries[-1]
+            entries[-1] = (start, buf + line)
+        else:
+            entries.append((off, line))
+    return [_Segment(entries)]
+
+
+CHUNKERS: Dict[str, Callable[[str], List[_Segment]]] = {
+    ".md": _segments_markdown,
+    ".py": _segments_python,
+    ".log": _segments_log,
+    ".txt": _segments_text,
+}
+
+
+def chunk_text(
+    text: str,
+    suffix: str,
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+) -> List[TextChunk]:
+    max_tokens = max_tokens or settings.chunk_max_tokens
+    overlap = (
+        settings.chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+    )
+    segmenter = CHUNKERS.get(suffix.lower(), _segments_text)
+    chunks: List[TextChunk] = []
+    for seg in segmenter(text):
+        for start, body in _pack(seg.units, max_tokens, overlap):
+            stripped = body.strip()
+            if not stripped:
+                continue
+            lead = len(body) - len(body.lstrip())
+            chunks.append(
+                TextChunk(
+                    text=stripped,
+                    start=start + lead,
+                    end=start + lead + len(stripped),
+                    section=seg.section,
+                    symbol=seg.symbol,
+                )
+            )
+    return chunks
@@ -0,0 +1,127 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Préfixes ajoutés par le graphe, ignorés pour la comparaison des contenus
+_PREFIX_RE = re.compile(r"^(DOC: (\[[^\]]*\] )?)|( \(score=[0-9.]+\))$")
+
+_counters: Dict[str, Callable[[str], int]] = {}
+_count_lock = threading.Lock()
+
+
+def _tiktoken_counter(enc) -> Callable[[str], int]:
+    def count(text: str) -> int:
+        return len(enc.encode(text, disallowed_special=()))
+
+    return count
+
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Nombre de tokens selon le tokenizer du modèle (tiktoken), par défaut le
+    modèle de génération. Si l'encodage est indisponible (pas de cache local
+    ni d'accès réseau), repli sur une estimation à 4 caractères par token,
+    signalée une fois par modèle.
+    """
+    model = model or settings.chat_model
+    count = _counters.get(model)
+    if count is None:
+        with _count_lock:
+            count = _counters.get(model)
+            if count is None:
+                try:
+                    import tiktoken
+
+                    count = _tiktoken_counter(tiktoken.encoding_for_model(model))
+                except Exception as e:
+                    log.warning("tiktoken indisponible pour %s (%s) : len/4", model, e)
+                    count = _estimate_tokens
+                _counters[model] = count
+    return count(text)
+
+
+def _shingles(line: str, n: int = 3) -> FrozenSet[Tuple[str, ...]]:
+    words = _WORD_RE.findall(_PREFIX_RE.sub("", line).casefold())
+    if len(words) < n:
+        return frozenset([tuple(words)]) if words else frozenset()
+    return frozenset(tuple(words[i : i + n]) for i in range(len(words) - n + 1))
+
+
+def _near_duplicate(s: FrozenSet, kept: List[FrozenSet], threshold: float) -> bool:
+    """Contenu déjà couvert : la majeure partie de ses n-grammes figure ailleurs."""
+    if not s:
+        return True
+    return any(len(s & k) / len(s) >= threshold for k in kept)
+
+
+@dataclass
+class ContextReport:
+    tokens_in: int = 0
+    tokens_out: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+    # Lignes de mémoire retenues dans le contexte final
+    memory_lines: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+
+def assemble_context(
+    memory_lines: List[str],
+    doc_lines: List[str],
+    budget_tokens: Optional[int] = None,
+    dedup_threshold: Optional[float] = None,
+) -> Tuple[str, ContextReport]:
+    """
+    Contexte du prompt sous un budget de tokens, sans doublons.
+    Priorité : passages documentaires dans l'ordre de pertinence, puis mémoire
+    du plus récent au plus ancien. Une ligne dont le contenu est déjà couvert
+    par une ligne retenue (chunks voisins qui se recouvrent, tour de mémoire
+    qui répète un passage) est écartée ; une ligne qui ne tient plus dans le
+    budget aussi. Le texte final garde l'ordre mémoire puis documents.
+    budget_tokens=0 : pas de limite.
+    """
+    budget = settings.context_token_budget if budget_tokens is None else budget_tokens
+    threshold = (
+        settings.context_dedup_threshold if dedup_threshold is None else dedup_threshold
+    )
+    report = ContextReport()
+    candidates = [("docs", i, line) for i, line in enumerate(doc_lines)] + [
+        ("memory", i, line) for i, line in reversed(list(enumerate(memory_lines)))
+    ]
+    kept_shingles: List[FrozenSet] = []
+    kept = set()
+    used = 0
+    for kind, i, line in candidates:
+        # +1 : saut de ligne entre deux lignes du contexte
+        n = count_tokens(line) + 1
+        report.tokens_in += n
+        s = _shingles(line)
+        if _near_duplicate(s, kept_shingles, threshold):
+            report.duplicates += 1
+            continue
+        if budget and used + n > budget:
+            report.over_budget += 1
+            continue
+        kept.add((kind, i))
+        kept_shingles.append(s)
+        used += n
+    report.tokens_out = used
+    report.memory_lines = sum(1 for kind, _ in kept if kind == "memory")
+    lines = [line for i, line in enumerate(memory_lines) if ("memory", i) in kept] + [
+        line for i, line in enumerate(doc_lines) if ("docs", i) in kept
+    ]
+    return "\n".join(lines), report
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from settings import settings
+
+
+def normalize_query(text: str) -> str:
+    """Forme canonique d'une requête : NFKC, casse neutralisée, espaces réduits."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(
+        f"{model}\0{normalize_query(text)}".encode("utf-8")
+    ).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """
+    Cache à deux niveaux des embeddings de requêtes.
+    - niveau 1 : LRU borné en mémoire du process (max_entries)
+    - niveau 2 : fichier sqlite optionnel (WAL), partagé entre workers,
+      borné à disk_max_entries (les moins récemment utilisés sont purgés)
+    Clé : sha256(modèle + requête normalisée). ttl_s=0 : pas d'expiration.
+    """
+
+    # Purge du niveau disque tous les N ajouts seulement (coût amorti)
+    PRUNE_EVERY = 256
+    # Mises à jour de used_at (hits disque) écrites par lots de N
+    TOUCH_EVERY = 64
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        disk_path: str = "",
+        disk_max_entries: int = 100_000,
+        ttl_s: float = 0,
+    ):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl_s = ttl_s
+        self._lru: "OrderedDict[str, tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._touched: Dict[str, float] = {}
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions_memory = 0
+        self.evictions_disk = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                "created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS query_embeddings_used "
+                "ON query_embeddings (used_at)"
+            )
+            self._db.commit()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_s > 0 and now - created_at > self.ttl_s
+
+    def get(self, key: str) -> Optional[List[float]]:
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry and not self._expired(entry[0], now):
+                self._lru.move_to_end(key)
+                self.hits_memory += 1
+                return entry[1]
+            if entry:
+                del self._lru[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector, created_at FROM query_embeddings WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row and not self._expired(row[1], now):
+                    vec = array("f")
+                    vec.frombytes(row[0])
+                    vector = vec.tolist()
+                    # used_at différé : pas d'écriture (ni d'attente de verrou
+                    # sqlite) à chaque hit
+                    self._touched[key] = now
+                    if len(self._touched) >= self.TOUCH_EVERY:
+                        self._flush_touched()
+                        self._db.commit()
+                    self._remember(key, row[1], vector)
+                    self.hits_disk += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: List[float]):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, vector)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                (key, array("f", vector).tobytes(), now, now),
+            )
+            self._puts += 1
+            self._flush_touched()
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._prune_disk(now)
+            self._db.commit()
+
+    @property
+    def has_disk(self) -> bool:
+        return self._db is not None
+
+    def _flush_touched(self):
+        if self._db is None or not self._touched:
+            return
+        self._db.executemany(
+            "UPDATE query_embeddings SET used_at = ? WHERE key = ?",
+            [(used_at, key) for key, used_at in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def _remember(self, key: str, created_at: float, vector: List[float]):
+        self._lru[key] = (created_at, vector)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.evictions_memory += 1
+
+    def _prune_disk(self, now: float):
+        assert self._db is not None
+        if self.ttl_s > 0:
+            self._db.execute(
+                "DELETE FROM query_embeddings WHERE created_at < ?", (now - self.ttl_s,)
+            )
+        cur = self._db.execute(
+            "DELETE FROM query_embeddings WHERE key IN ("
+            "SELECT key FROM query_embeddings ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+        self.evictions_disk += max(cur.rowcount, 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._lru),
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "evictions_memory": self.evictions_memory,
+                "evictions_disk": self.evictions_disk,
+                "max_entries": self.max_entries,
+                "disk_max_entries": self.disk_max_entries if self._db else 0,
+            }
+
+
+_cache: Optional[QueryEmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> Optional[QueryEmbeddingCache]:
+    """Cache partagé du process ; None si QUERY_CACHE_SIZE vaut 0."""
+    global _cache
+    if settings.query_cache_size <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryEmbeddingCache(
+                max_entries=settings.query_cache_size,
+                disk_path=settings.query_cache_path,
+                disk_max_entries=settings.query_cache_disk_max_entries,
+                ttl_s=settings.query_cache_ttl_s,
+            )
+        return _cache
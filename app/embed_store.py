@@ -0,0 +1,192 @@
+import fcntl
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from settings import settings
+
+
+class EmbeddingStore:
+    """
+    Store local d'embeddings, indépendant de Qdrant.
+    - vecteurs float32 ajoutés en fin de fichier <key>.f32, lus par memmap
+    - index sqlite <key>.sqlite : sha256 du texte du chunk → numéro de ligne
+    - ajouts sérialisés entre process par un verrou fcntl sur le .f32
+    La clé (modèle + dimension) évite de mélanger des espaces vectoriels.
+
+    Utilisation :
+        store = EmbeddingStore("/data/embeddings", "text-embedding-3-small", 1536)
+        found = store.get_many(["<sha256>", ...])   # {hash: vecteur}
+        store.put_many([("<sha256>", vecteur), ...])
+    """
+
+    def __init__(self, root: str, model: str, dim: int):
+        os.makedirs(root, exist_ok=True)
+        self.model = model
+        self.dim = dim
+        key = f"{model}-{dim}"
+        self.vectors_path = os.path.join(root, f"{key}.f32")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, f"{key}.sqlite"), check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        if not os.path.exists(self.vectors_path):
+            open(self.vectors_path, "wb").close()
+        self._rows = os.path.getsize(self.vectors_path) // (4 * dim)
+        self._mmap: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def _view(self) -> np.memmap:
+        # Le fichier ne grossit que par la fin, y compris par d'autres process :
+        # on relit sa taille et on remappe quand il a grandi
+        self._rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        if self._mmap is None or self._mmap.shape[0] < self._rows:
+            self._mmap = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(self._rows, self.dim),
+            )
+        return self._mmap
+
+    def _rows_for(self, hashes: List[str]) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        # Par paquets : sqlite limite le nombre de paramètres d'une requête
+        for i in range(0, len(hashes), 500):
+            part = hashes[i : i + 500]
+            marks = ",".join("?" * len(part))
+            out.update(
+                self._db.execute(
+                    f"SELECT hash, row FROM vectors WHERE hash IN ({marks})", part
+                ).fetchall()
+            )
+        return out
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        hashes = list(dict.fromkeys(hashes))
+        if not hashes:
+            return {}
+        with self._lock:
+            rows = self._rows_for(hashes)
+            if not rows:
+                return {}
+            view = self._view()
+            return {h: view[row].tolist() for h, row in rows.items()}
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]) -> int:
+        """Ajoute les vecteurs absents du store. Retourne le nombre ajouté."""
+        fresh: Dict[str, List[float]] = dict(items)
+        if not fresh:
+            return 0
+        row_bytes = 4 * self.dim
+        with self._lock, open(self.vectors_path, "ab") as f:
+            # Un autre process (CLI --rebuild, API /ingest) peut écrire le même
+            # store : verrou exclusif le temps de dédupliquer, écrire et indexer
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                for h in self._rows_for(list(fresh)):
+                    del fresh[h]
+                if not fresh:
+                    return 0
+                arr = np.asarray(list(fresh.values()), dtype=np.float32)
+                if arr.shape[1] != self.dim:
+                    raise ValueError(
+                        f"Dimension {arr.shape[1]} != {self.dim} ({self.model})"
+                    )
+                # Une ligne partielle laissée par un crash décalerait toutes les
+                # suivantes : on la coupe avant de calculer la première ligne
+                size = os.fstat(f.fileno()).st_size
+                if size % row_bytes:
+                    f.truncate(size - size % row_bytes)
+                f.seek(0, os.SEEK_END)
+                start = f.tell() // row_bytes
+                # Vecteurs écrits avant l'index : une ligne orpheline est
+                # inoffensive, un index pointant hors du fichier ne l'est pas
+                f.write(arr.tobytes())
+                f.flush()
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO vectors (hash, row) VALUES (?, ?)",
+                    [(h, start + i) for i, h in enumerate(fresh)],
+                )
+                self._db.commit()
+                self._rows = start + len(fresh)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return len(fresh)
+
+    def export(self, hashes: Iterable[str], path: str) -> int:
+        """Écrit les vecteurs connus parmi hashes dans un .npz portable."""
+        found = self.get_many(hashes)
+        np.savez_compressed(
+            path,
+            model=np.array(self.model),
+            hashes=np.array(list(found), dtype=str),
+            vectors=np.asarray(list(found.values()), dtype=np.float32).reshape(
+                -1, self.dim
+            ),
+        )
+        return len(found)
+
+    def import_file(self, path: str) -> int:
+        data = np.load(path)
+        if str(data["model"]) != self.model:
+            raise ValueError(
+                f"Export {path} produit avec {data['model']}, pas {self.model}"
+            )
+        hashes = [str(h) for h in data["hashes"]]
+        vectors = data["vectors"]
+        added = 0
+        for i in range(0, len(hashes), 1000):
+            added += self.put_many(
+                (h, vectors[i + j].tolist()) for j, h in enumerate(hashes[i : i + 1000])
+            )
+        return added
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(model: str, dim: int) -> Optional[EmbeddingStore]:
+    """Store partagé du process pour (modèle, dimension) ; None si désactivé."""
+    if not settings.embed_store_dir:
+        return None
+    key = f"{model}-{dim}"
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(settings.embed_store_dir, model, dim)
+        return _stores[key]
+
+
+if __name__ == "__main__":
+    # python embed_store.py export <project> <fichier.npz>
+    # python embed_store.py import <fichier.npz>
+    import sys
+
+    from ingest_docs import load_manifest
+    from retriever import EMBED_MODEL, embed_dim
+
+    store = get_store(EMBED_MODEL, embed_dim())
+    if store is None:
+        sys.exit("EMBED_STORE_DIR est vide : store désactivé")
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "export" and len(sys.argv) == 4:
+        files = load_manifest(sys.argv[2]).get("files", {})
+        hashes = [h for entry in files.values() for h in entry["chunks"]]
+        n = store.export(hashes, sys.argv[3])
+        print(f"Exported {n}/{len(hashes)} vectors for project={sys.argv[2]}")
+    elif cmd == "import" and len(sys.argv) == 3:
+        n = store.import_file(sys.argv[2])
+        print(f"Imported {n} new vectors into {store.vectors_path}")
+    else:
+        sys.exit(
+            "usage: embed_store.py export <project> <file.npz> | import <file.npz>"
+        )
@@ -0,0 +1,394 @@
+"""
+Gouverneur des appels vers les services amont (OpenAI, Zep, Qdrant).
+
+Chaque service a son Limiter : au plus `concurrency` appels en cours, un débit
+optionnel (token bucket, `rps`), et une file d'attente bornée (`max_queue`)
+avec un délai max (`queue_timeout_s`). Au-delà, l'appel échoue tout de suite
+avec Overloaded, que l'API traduit en 429/503 avec Retry-After au lieu
+d'empiler les requêtes sur un service déjà saturé.
+
+Les erreurs transitoires (429, 5xx, réseau) sont rejouées avec backoff
+exponentiel et jitter ; une fois les essais épuisés, elles deviennent
+aussi Overloaded.
+
+    docs = await acall("qdrant", lambda: client.search(...))
+    async with get_limiter("openai_chat").slot():   # slot gardé pendant le flux
+        stream = await aretry("openai_chat", lambda: create(...))
+
+Les limites portent sur le chemin async des requêtes ; les appels sync
+(ingestion, CLI) n'utilisent que retry(), l'ingestion ayant son propre budget.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+from openai import APIConnectionError
+
+from metrics import UPSTREAM_WAIT_SECONDS, span
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Overloaded(Exception):
+    """
+    Service amont saturé : file d'attente pleine ou délai dépassé (503),
+    débit ou quota amont atteint (429). retry_after_s : délai conseillé.
+    """
+
+    def __init__(self, upstream: str, reason: str, retry_after_s: float, status: int):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+        self.status = status
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after_s)))
+
+
+# === Retry
+
+
+def retry_after(err: Exception) -> Optional[float]:
+    """En-tête Retry-After de la réponse d'erreur, s'il y en a un."""
+    response = getattr(err, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))  # type: ignore[union-attr]
+    except Exception:
+        return None
+
+
+def is_retryable(err: Exception) -> bool:
+    """429, 5xx, timeouts et erreurs réseau (OpenAI, Zep, Qdrant, httpx)."""
+    if isinstance(err, Overloaded):
+        return False
+    status = getattr(err, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # APITimeoutError hérite de APIConnectionError
+    return isinstance(err, (APIConnectionError, httpx.TransportError))
+
+
+def backoff_delay(
+    attempt: int,
+    base_s: Optional[float] = None,
+    max_s: Optional[float] = None,
+    hint_s: Optional[float] = None,
+) -> float:
+    """
+    Délai avant l'essai attempt+1 : base * 2^attempt plafonné à max_s, avec
+    jitter ±50 % (les clients ne repartent pas tous ensemble). Un Retry-After
+    fourni par le service (hint_s) est respecté tel quel.
+    """
+    if hint_s is not None and hint_s > 0:
+        return hint_s
+    base_s = settings.upstream_retry_base_s if base_s is None else base_s
+    max_s = settings.upstream_retry_max_s if max_s is None else max_s
+    return min(max_s, base_s * 2**attempt) * random.uniform(0.5, 1.5)
+
+
+def _exhausted(upstream: str, err: Exception) -> Overloaded:
+    status = 429 if getattr(err, "status_code", None) == 429 else 503
+    hint = retry_after(err) or settings.upstream_retry_max_s
+    return Overloaded(upstream, f"{type(err).__name__} après retries", hint, status)
+
+
+async def aretry(
+    upstream: str,
+    fn: Callable[[], Awaitable[T]],
+    max_retries: Optional[int] = None,
+) -> T:
+    """
+    Rejoue fn() sur erreur transitoire ; Overloaded une fois les essais épuisés.
+    max_retries=0 : un seul essai, l'erreur d'origine remonte telle quelle
+    (l'appelant a sa propre politique de retry).
+    """
+    max_retries = settings.upstream_max_retries if max_retries is None else max_retries
+    if max_retries <= 0:
+        return await fn()
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if attempt >= max_retries:
+                get_limiter(upstream).failures += 1
+                raise _exhausted(upstream, e) from e
+            delay = backoff_delay(attempt, hint_s=retry_after(e))
+            get_limiter(upstream).retries += 1
+            log.warning(
+                "%s: %s, nouvel essai %d/%d dans %.2fs",
+                upstream,
+                type(e).__name__,
+                attempt + 1,
+                max_retries,
+                delay,
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def retry(
+    upstream: str,
+    fn: Callable[[], T],
+    max_retries: Optional[int] = None,
+    op: Optional[str] = None,
+) -> T:
+    """
+    Variante synchrone de aretry() (ingestion, scripts). Chaque essai est
+    mesuré par un span "upstream" (<upstream>.<op>).
+    """
+    name = f"{upstream}.{op}" if op else upstream
+
+    def attempt_once() -> T:
+        with span("upstream", name):
+            return fn()
+
+    max_retries = settings.upstream_max_retries if max_retries is None else max_retries
+    if max_retries <= 0:
+        return attempt_once()
+    attempt = 0
+    while True:
+        try:
+            return attempt_once()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if attempt >= max_retries:
+                get_limiter(upstream).failures += 1
+                raise _exhausted(upstream, e) from e
+            delay = backoff_delay(attempt, hint_s=retry_after(e))
+            get_limiter(upstream).retries += 1
+            log.warning(
+                "%s: %s, nouvel essai %d/%d dans %.2fs",
+                upstream,
+                type(e).__name__,
+                attempt + 1,
+                max_retries,
+                delay,
+            )
+            attempt += 1
+            time.sleep(delay)
+
+
+# === Limites par service
+
+
+class Limiter:
+    """
+    Sémaphore + token bucket d'un service amont, avec file d'attente bornée.
+    - concurrency : appels simultanés max (0 = illimité)
+    - rps : débit max en appels/s, rafale de max(1, rps) (0 = illimité)
+    - max_queue : appels en attente max ; au-delà, rejet immédiat (503)
+    - queue_timeout_s : attente max d'un slot ; au-delà, rejet (503)
+    Les slots sont remis dans l'ordre d'arrivée (FIFO).
+    À utiliser dans une seule boucle asyncio.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        rps: float = 0.0,
+        max_queue: int = 64,
+        queue_timeout_s: float = 5.0,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.rps = rps
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._burst = max(1.0, rps)
+        self._tokens = self._burst
+        self._refilled_at = time.monotonic()
+        # Durée moyenne d'occupation d'un slot (EWMA), pour estimer Retry-After
+        self._hold_s = 0.0
+        self.acquired = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def _estimate_wait(self) -> float:
+        slots = max(1, self.concurrency)
+        return max(1.0, self._hold_s * (len(self._waiters) + 1) / slots)
+
+    def _release(self):
+        # Le slot passe directement au premier appel en attente encore vivant
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    async def _acquire_slot(self, deadline: float):
+        if self.concurrency <= 0:
+            self._active += 1
+            return
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.name, "file pleine", self._estimate_wait(), 503)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.max_depth = max(self.max_depth, len(self._waiters))
+        try:
+            await asyncio.wait_for(
+                waiter, timeout=max(0.0, deadline - time.monotonic())
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Slot reçu au moment de l'abandon : on le passe au suivant
+                self._release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timeouts += 1
+            raise Overloaded(
+                self.name, "délai d'attente dépassé", self._estimate_wait(), 503
+            )
+
+    def _reserve_token(self) -> float:
+        """Réserve un jeton ; retourne l'attente nécessaire avant l'appel."""
+        if self.rps <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._refilled_at) * self.rps
+        )
+        self._refilled_at = now
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rps)
+
+    @asynccontextmanager
+    async def slot(self, timeout_s: Optional[float] = None):
+        timeout_s = self.queue_timeout_s if timeout_s is None else timeout_s
+        started = time.monotonic()
+        deadline = started + timeout_s
+        await self._acquire_slot(deadline)
+        try:
+            wait_s = self._reserve_token()
+            if wait_s > 0:
+                if time.monotonic() + wait_s > deadline:
+                    self._tokens += 1
+                    self.rejected += 1
+                    raise Overloaded(self.name, "débit max atteint", wait_s, 429)
+                self.throttled += 1
+                await asyncio.sleep(wait_s)
+        except BaseException:
+            self._release()
+            raise
+        self.acquired += 1
+        UPSTREAM_WAIT_SECONDS.labels(self.name).observe(time.monotonic() - started)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_s = 0.9 * self._hold_s + 0.1 * (time.monotonic() - started)
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "depth": len(self._waiters),
+            "max_depth": self.max_depth,
+            "concurrency": self.concurrency,
+            "rps": self.rps,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "failures": self.failures,
+            "avg_hold_ms": round(self._hold_s * 1000, 1),
+        }
+
+
+def _limits(name: str) -> Dict[str, float]:
+    return {
+        "openai_chat": {
+            "concurrency": settings.openai_chat_concurrency,
+            "rps": settings.openai_chat_rps,
+        },
+        "openai_embed": {
+            "concurrency": settings.openai_embed_concurrency,
+            "rps": settings.openai_embed_rps,
+        },
+        "zep": {"concurrency": settings.zep_concurrency},
+        "qdrant": {"concurrency": settings.qdrant_concurrency},
+    }.get(name, {"concurrency": 0})
+
+
+_limiters: Dict[str, Limiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream: str) -> Limiter:
+    """Limiter partagé du process pour un service amont (créé au premier usage)."""
+    with _limiters_lock:
+        limiter = _limiters.get(upstream)
+        if limiter is None:
+            limiter = _limiters[upstream] = Limiter(
+                upstream,
+                max_queue=settings.upstream_max_queue,
+                queue_timeout_s=settings.upstream_queue_timeout_s,
+                **_limits(upstream),
+            )
+        return limiter
+
+
+async def acall(
+    upstream: str,
+    fn: Callable[[], Awaitable[T]],
+    max_retries: Optional[int] = None,
+    op: Optional[str] = None,
+) -> T:
+    """
+    Appel limité et rejoué : un slot par essai, rendu pendant le backoff
+    pour ne pas bloquer les autres appels. Chaque essai est mesuré par un
+    span "upstream" (<upstream>.<op>), hors attente du slot.
+    """
+    limiter = get_limiter(upstream)
+    name = f"{upstream}.{op}" if op else upstream
+
+    async def attempt() -> T:
+        async with limiter.slot():
+            with span("upstream", name):
+                return await fn()
+
+    return await aretry(upstream, attempt, max_retries)
+
+
+def governor_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -1,35 +1,183 @@
+import asyncio
+import hashlib
 import logging
-import os
-from typing import Any, Dict, List, TypedDict
-
-from langgraph.checkpoint.postgres import PostgresSaver
-from langgraph.graph import END, StateGraph
-from memory import ZepMemory
-from openai import OpenAI
-from retriever import DocsRetriever
+from typing import Annotated, Any, Dict, List, Optional, TypedDict
+
+from answer_cache import doc_signature, get_answer_cache
+from attachments import AttachmentError, get_attachment_store
+from context_budget import assemble_context
+from governor import aretry, get_limiter
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.config import get_stream_writer
+from langgraph.graph import END, START, StateGraph
+from memory import AsyncZepMemory
+from memory_queue import get_memory_queue
+from metrics import record_tokens, span, traced_node
+from openai import AsyncOpenAI
+from retriever import DocHit, DocsRetriever, aembed
 from settings import settings
+from singleflight import Emit, get_singleflight, normalize_question
+from turn_buffer import get_turn_buffer
 
 log = logging.getLogger(__name__)
 log.debug("Je suis dans graph.py")
 
 
-client = OpenAI(api_key=settings.openai_api_key)
+# Client OpenAI créé au premier appel ; DocsRetriever ouvre ses clients Qdrant
+# de même, l'import du module ne construit aucun client
+_client: Optional[AsyncOpenAI] = None
 docs_retriever = DocsRetriever()
 
 
+def chat_client() -> AsyncOpenAI:
+    global _client
+    if _client is None:
+        # Retries du SDK désactivés : aretry (gouverneur) est la seule couche
+        _client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0)
+    return _client
+
+
+# Nb de messages de mémoire injectés dans le contexte
+MEMORY_LIMIT = 6
+# Nb de tours utilisateur récents utilisés comme requêtes de recherche (/chat)
+RETRIEVAL_TURNS = 3
+
+
+def merge_contexts(
+    left: Dict[str, List[str]] | None, right: Dict[str, List[str]] | None
+) -> Dict[str, List[str]]:
+    """Réducteur : chaque branche de récupération écrit sa propre clé."""
+    return {**(left or {}), **(right or {})}
+
+
+def _strip_images(message: Dict[str, Any]) -> Dict[str, Any]:
+    content = message.get("content")
+    if not isinstance(content, list) or all(p.get("type") != "image" for p in content):
+        return message
+    parts = [p for p in content if p.get("type") != "image"]
+    return {**message, "content": parts or [{"type": "text", "text": "[image]"}]}
+
+
+def append_messages(
+    left: List[Dict[str, Any]] | None, right: List[Dict[str, Any]] | None
+) -> List[Dict[str, Any]]:
+    """
+    Réducteur de l'historique /chat : le client n'envoie que les nouveaux
+    messages, l'historique vient du checkpoint du thread. Seuls les
+    CHAT_HISTORY_WINDOW derniers messages sont gardés, et les images ne sont
+    conservées que sur le dernier message utilisateur : la taille du
+    checkpoint reste bornée quelle que soit la longueur de la conversation.
+
+    Le message utilisateur est checkpointé avant l'exécution : après un échec
+    (429/503 avec Retry-After), il reste en fin d'historique sans réponse.
+    Un nouveau message utilisateur remplace ces messages sans réponse, si
+    bien qu'un retry du même tour ne le duplique pas.
+    """
+    left = list(left or [])
+    right = list(right or [])
+    if right and right[0].get("role") == "user":
+        while left and left[-1].get("role") == "user":
+            left.pop()
+    merged = left + right
+    if settings.chat_history_window > 0:
+        merged = merged[-settings.chat_history_window :]
+    last_user = max(
+        (i for i, m in enumerate(merged) if m.get("role") == "user"), default=-1
+    )
+    return [m if i == last_user else _strip_images(m) for i, m in enumerate(merged)]
+
+
 class GraphState(TypedDict):
     session_id: str
     project: str
     question: str | None
-    messages: List[Dict[str, Any]] | None
-    context: List[str]
+    # /chat : historique du thread, reconstruit à partir du checkpoint
+    messages: Annotated[List[Dict[str, Any]], append_messages]
+    # {"memory": [...], "docs": [...]} : alimenté en parallèle par les deux branches
+    contexts: Annotated[Dict[str, List[str]], merge_contexts]
+    # IDs des passages récupérés : clé du cache de réponses avec la question
+    doc_ids: List[str]
+    # Contexte du prompt de reason, assemblé sous budget par check_cache
+    prompt_context: str
+    # Lignes de mémoire de session retenues dans prompt_context
+    prompt_memory: int
     answer: str
+    cached: bool
 
 
-def node_retrieve_memory(state: GraphState) -> GraphState:
-    mem = ZepMemory(session_id=state["session_id"], project=state.get("project"))
-    state["context"] = mem.retrieve_context(limit=6)
-    return state
+async def _with_timeout(branch: str, coro, timeout_s: float) -> List[str]:
+    """Une branche lente ou en erreur donne un contexte vide au lieu de bloquer."""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout_s)
+    except asyncio.TimeoutError:
+        log.warning("Branche %s abandonnée après %.1fs", branch, timeout_s)
+    except Exception as e:
+        log.warning("Branche %s en erreur: %s", branch, e)
+    return []
+
+
+async def _memory_lines(state: GraphState) -> List[str]:
+    """
+    Derniers tours de la session, précédés des messages plus anciens pertinents
+    pour la question (recherche sémantique Zep), seulement quand un tel
+    historique existe. assemble_context retire en premier les plus anciens
+    quand le budget de tokens est atteint. Aucune ligne pour une question
+    /ask servie par le cache de réponses (cf. _docs_only).
+    """
+    mem = AsyncZepMemory(session_id=state["session_id"], project=state.get("project"))
+    buffer = get_turn_buffer()
+    created = await mem.ensure_user()
+    if created and buffer is not None:
+        buffer.start(mem.session_id)
+    if _docs_only(state):
+        return []
+    if buffer is None:
+        recent = await mem.recent_messages(limit=MEMORY_LIMIT)
+        older = len(recent) >= MEMORY_LIMIT
+    else:
+        # Derniers tours servis localement ; Zep seulement si le buffer ne suffit
+        # pas (session inconnue après redémarrage ou éviction, historique court)
+        recent = buffer.recent(mem.session_id, MEMORY_LIMIT)
+        if recent is not None:
+            older = buffer.has_older(mem.session_id, MEMORY_LIMIT)
+        else:
+            # Lecture chronologique (pas une recherche par pertinence) : le
+            # buffer sert ces lignes comme les derniers tours de la session
+            recent = await mem.recent_messages(limit=MEMORY_LIMIT)
+            # Moins de messages que demandé : Zep n'a pas d'historique plus ancien
+            older = len(recent) >= MEMORY_LIMIT
+            buffer.seed(mem.session_id, recent, complete=not older)
+    if not older or settings.zep_search_limit <= 0:
+        return recent
+    return await _older_lines(mem, state, recent) + recent
+
+
+async def _older_lines(
+    mem: AsyncZepMemory, state: GraphState, recent: List[str]
+) -> List[str]:
+    query = state.get("question") or _extract_query_from_messages(
+        state.get("messages") or []
+    )
+    if not query:
+        return []
+    try:
+        # Les derniers tours peuvent ressortir de la recherche : on en demande
+        # d'autant plus, puis on les écarte
+        found = await mem.search_context(
+            query, limit=settings.zep_search_limit + len(recent)
+        )
+    except Exception as e:
+        log.warning("Recherche Zep de %s en erreur: %s", mem.session_id, e)
+        return []
+    seen = set(recent)
+    return [line for line in found if line not in seen][: settings.zep_search_limit]
+
+
+async def node_retrieve_memory(state: GraphState) -> Dict[str, Any]:
+    lines = await _with_timeout(
+        "memory", _memory_lines(state), settings.memory_timeout_s
+    )
+    return {"contexts": {"memory": lines}}
 
 
 def _extract_query_from_messages(messages: List[Dict[str, Any]]) -> str:
@@ -42,23 +190,228 @@ def _extract_query_from_messages(messages: List[Dict[str, Any]]) -> str:
     return ""
 
 
-def node_retrieve_docs(state: GraphState) -> GraphState:
-    query = state.get("question") or _extract_query_from_messages(
-        state.get("messages") or []
+def _recent_user_queries(messages: List[Dict[str, Any]], n: int) -> List[str]:
+    """Textes des n derniers tours utilisateur, du plus récent au plus ancien."""
+    queries: List[str] = []
+    for m in reversed(messages or []):
+        if len(queries) >= n:
+            break
+        if m.get("role") == "user":
+            parts = m.get("content") or []
+            texts = [p.get("text", "") for p in parts if p.get("type") == "text"]
+            if texts and texts[-1].strip():
+                queries.append(texts[-1])
+    return queries
+
+
+def _last_user_images(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for m in reversed(messages or []):
+        if m.get("role") == "user":
+            content = m.get("content")
+            if isinstance(content, list):
+                return [p for p in content if p.get("type") == "image"]
+            return []
+    return []
+
+
+def _image_inputs(parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Références {"type": "image", "ref": <sha256>} → parts image_url du modèle.
+    Le contenu n'est lu qu'ici, juste avant l'appel LLM : ni la requête ni le
+    checkpoint ne transportent l'image. Les data_url inline restent acceptées.
+    """
+    inputs = []
+    for p in parts:
+        url = p.get("data_url")
+        if p.get("ref"):
+            try:
+                url = get_attachment_store().data_url(p["ref"])
+            except AttachmentError as e:
+                log.warning("Pièce jointe ignorée: %s", e)
+            if url is None:
+                log.warning("Pièce jointe introuvable: %s", p["ref"])
+        if url:
+            inputs.append({"type": "image_url", "image_url": {"url": url}})
+    return inputs
+
+
+def _doc_queries(state: GraphState) -> List[str]:
+    if state.get("question"):
+        return [state["question"]]
+    # Le dernier tour seul est souvent elliptique : les tours précédents
+    # sont cherchés dans le même lot et fusionnés (RRF)
+    return _recent_user_queries(state.get("messages") or [], RETRIEVAL_TURNS)
+
+
+async def _doc_hits(project: str, queries: List[str]) -> List[DocHit]:
+    if not queries:
+        return []
+    mmr_lambda = settings.retrieval_mmr_lambda
+    return await docs_retriever.asearch_hits(
+        queries,
+        top_k=settings.retrieval_top_k,
+        project=project,
+        mmr_lambda=mmr_lambda if mmr_lambda < 1 else None,
     )
-    if not query:
-        state["context"] = state.get("context") or []
-        return state
-    hits = docs_retriever.search(
-        query=query, top_k=4, project=state.get("project") or "default"
+
+
+async def _shared_doc_hits(state: GraphState) -> List[DocHit]:
+    """
+    Requêtes identiques en cours sur le même projet (même question posée au
+    même moment) : un seul embed + recherche Qdrant, partagé.
+    """
+    project = state.get("project") or "default"
+    queries = _doc_queries(state)
+    flights = get_singleflight()
+    if flights is None or not queries:
+        return await _doc_hits(project, queries)
+    key = ("docs", project, tuple(normalize_question(q) for q in queries))
+    return await flights.run(key, lambda _: _doc_hits(project, queries))
+
+
+async def node_retrieve_docs(state: GraphState) -> Dict[str, Any]:
+    hits = await _with_timeout("docs", _shared_doc_hits(state), settings.docs_timeout_s)
+    return {
+        "contexts": {"docs": [f"DOC: {h.text} (score={h.score:.3f})" for h in hits]},
+        "doc_ids": [h.id for h in hits],
+    }
+
+
+def _cache_query(state: GraphState) -> str:
+    """Question servie par le cache de réponses ; "" si non éligible (images)."""
+    if state.get("question"):
+        return state["question"]
+    messages = state.get("messages") or []
+    if _last_user_images(messages):
+        return ""
+    return _extract_query_from_messages(messages)
+
+
+def _cacheable_query(state: GraphState) -> str:
+    """
+    Question cherchée et stockée dans le cache de réponses ; "" si la réponse
+    dépend d'autre chose que du projet, de la question et des passages :
+    images, ou mémoire de session retenue dans le prompt. Une telle réponse
+    ne doit pas être servie à une autre session.
+    """
+    if not state.get("doc_ids") or state.get("prompt_memory"):
+        return ""
+    return _cache_query(state)
+
+
+def _docs_only(state: GraphState) -> bool:
+    """
+    Question /ask avec cache de réponses actif : prompt construit sur les seuls
+    passages, sans mémoire de session, pour que la réponse soit partageable
+    (cache, regroupement) entre sessions. Compromis : /ask ne tient plus compte
+    de l'historique de la session. /chat garde sa mémoire ; ses tours ne sont
+    mis en cache que quand aucune ligne de mémoire n'entre dans le prompt.
+    """
+    return bool(state.get("question")) and get_answer_cache() is not None
+
+
+def _prompt_context(state: GraphState) -> Dict[str, Any]:
+    contexts = state.get("contexts") or {}
+    ctx_text, report = assemble_context(
+        contexts.get("memory", []), contexts.get("docs", [])
+    )
+    log.info(
+        "Contexte: %d tokens (%d économisés : %d doublons, %d hors budget)",
+        report.tokens_out,
+        report.tokens_saved,
+        report.duplicates,
+        report.over_budget,
+    )
+    return {"prompt_context": ctx_text, "prompt_memory": report.memory_lines}
+
+
+async def node_check_cache(state: GraphState) -> Dict[str, Any]:
+    """
+    Assemble le contexte du prompt (prompt_context), puis cherche une réponse
+    déjà produite pour une question proche, sur les mêmes passages : renvoyée
+    telle quelle, sans appel LLM (reason est sauté). Seulement si le prompt
+    ne contient aucune mémoire de session (cf. _cacheable_query).
+    """
+    update: Dict[str, Any] = {**_prompt_context(state), "cached": False}
+    cache = get_answer_cache()
+    query = _cacheable_query({**state, **update})
+    if cache is None or not query:
+        return update
+    try:
+        # Embedding déjà calculé par retrieve_docs : servi par le cache de requêtes
+        vector = (await aembed([query], cache=True))[0]
+    except Exception as e:
+        log.warning("Cache de réponses ignoré: %s", e)
+        return update
+    answer = cache.lookup(
+        state.get("project") or "default", vector, doc_signature(state["doc_ids"])
+    )
+    if answer is None:
+        return update
+    get_stream_writer()({"type": "token", "text": answer})
+    return {**update, "answer": answer, "cached": True}
+
+
+def route_after_cache(state: GraphState) -> str:
+    return "answer" if state.get("cached") else "reason"
+
+
+async def _cache_answer(state: GraphState, answer: str):
+    cache = get_answer_cache()
+    query = _cacheable_query(state)
+    if cache is None or not query or not answer:
+        return
+    try:
+        vector = (await aembed([query], cache=True))[0]
+    except Exception as e:
+        log.warning("Réponse non mise en cache: %s", e)
+        return
+    cache.store(
+        state.get("project") or "default",
+        vector,
+        doc_signature(state["doc_ids"]),
+        answer,
     )
-    lines = [f"DOC: {t} (score={score:.3f})" for t, score in hits]
-    state["context"] = (state.get("context") or []) + lines
-    return state
 
 
-def node_reason(state: GraphState) -> GraphState:
-    ctx_text = "\n".join(state.get("context", []))
+def _reason_key(state: GraphState) -> Optional[tuple]:
+    """
+    Clé de regroupement de reason : projet, question normalisée et contexte
+    effectivement envoyé au modèle (après dédoublonnage et budget). Deux
+    sessions dont la mémoire retenue diffère ne partagent pas une complétion ;
+    sans mémoire dans le prompt, la même question est regroupée entre
+    sessions. None si non éligible.
+    """
+    query = _cache_query(state)
+    if not query or not state.get("doc_ids"):
+        return None
+    prompt_context = state.get("prompt_context") or ""
+    return (
+        "reason",
+        state.get("project") or "default",
+        normalize_question(query),
+        hashlib.sha256(prompt_context.encode("utf-8")).hexdigest(),
+    )
+
+
+async def node_reason(state: GraphState) -> Dict[str, Any]:
+    """
+    Une même question, sur le même contexte de prompt, posée en même temps
+    par plusieurs appelants : une seule complétion, dont les tokens sont
+    diffusés à chacun (flux SSE compris). node_answer reste exécuté par
+    chaque appelant.
+    """
+    writer = get_stream_writer()
+    flights = get_singleflight()
+    key = _reason_key(state)
+    if flights is None or key is None:
+        return {"answer": await _reason(state, writer)}
+    answer = await flights.run(key, lambda emit: _reason(state, emit), on_event=writer)
+    return {"answer": answer}
+
+
+async def _reason(state: GraphState, emit: Emit) -> str:
+    ctx_text = state.get("prompt_context") or ""
     system_msg = (
         "Tu es un assistant concis et fiable.\n"
         "Utilise le contexte fourni quand pertinent et cite les DOCs entre crochets.\n"
@@ -66,81 +419,131 @@ def node_reason(state: GraphState) -> GraphState:
 
     if state.get("question"):
         prompt = f"Contexte:\n{ctx_text}\n\nQuestion:\n{state['question']}\n"
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.2,
-        )
-        state["answer"] = resp.choices[0].message.content
-        return state
+        answer = await _complete(system_msg, prompt, emit)
+        await _cache_answer(state, answer)
+        return answer
 
     messages = state.get("messages") or []
     user_text = _extract_query_from_messages(messages)
     content = [
         {"type": "text", "text": f"Contexte:\n{ctx_text}\n\nQuestion:\n{user_text}"}
     ]
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": content},
-        ],
-        temperature=0.2,
-    )
-    state["answer"] = resp.choices[0].message.content
-    return state
+    content += await asyncio.to_thread(_image_inputs, _last_user_images(messages))
+    answer = await _complete(system_msg, content, emit)
+    await _cache_answer(state, answer)
+    return answer
+
+
+async def _complete(system_msg: str, user_content: Any, emit: Emit) -> str:
+    """
+    Appel LLM en streaming : chaque fragment est publié via emit
+    ({"type": "token", "text": ...}) et la réponse complète est retournée.
+    emit est le writer du flux "custom" de LangGraph (sans effet hors
+    astream(stream_mode="custom")), ou la diffusion single-flight.
+
+    Le slot "openai_chat" du gouverneur est gardé jusqu'à la fin du flux ;
+    seule l'ouverture du flux est rejouée (aucun token n'est encore parti).
+    Service saturé : Overloaded remonte jusqu'à l'API (429/503).
+    L'usage (tokens prompt/complétion) arrive dans le dernier fragment.
+    """
+    parts: List[str] = []
+    async with get_limiter("openai_chat").slot():
+        with span("upstream", "openai_chat.completions"):
+            stream = await aretry(
+                "openai_chat",
+                lambda: chat_client().chat.completions.create(
+                    model=settings.chat_model,
+                    messages=[
+                        {"role": "system", "content": system_msg},
+                        {"role": "user", "content": user_content},
+                    ],
+                    temperature=0.2,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ),
+            )
+            async for chunk in stream:
+                record_tokens(settings.chat_model, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    emit({"type": "token", "text": delta})
+    return "".join(parts)
+
+
+async def _remember(mem: AsyncZepMemory, messages: List[Dict[str, str]]):
+    """
+    Tour ajouté au buffer local, puis écrit dans Zep : en différé si la file
+    tourne (app), sinon directement (scripts).
+    """
+    buffer = get_turn_buffer()
+    if buffer is not None:
+        buffer.append(mem.session_id, [m["content"] for m in messages])
+    queue = get_memory_queue()
+    if queue is not None and queue.running:
+        queue.enqueue(mem, messages)
+    else:
+        await mem.add_messages(messages)
 
 
-def node_answer(state: GraphState) -> GraphState:
-    mem = ZepMemory(session_id=state["session_id"], project=state.get("project"))
+async def node_answer(state: GraphState) -> Dict[str, Any]:
+    mem = AsyncZepMemory(session_id=state["session_id"], project=state.get("project"))
     if state.get("question"):
-        mem.add_messages(
+        await _remember(
+            mem,
             [
                 {"role": "user", "content": state["question"]},
                 {"role": "assistant", "content": state["answer"]},
-            ]
-        )
-    else:
-        last = _extract_query_from_messages(state.get("messages") or [])
-        mem.add_messages(
-            [
-                {"role": "user", "content": last},
-                {"role": "assistant", "content": state["answer"]},
-            ]
+            ],
         )
-    return state
-
-
-def _resolve_pg_dsn() -> str:
-    """
-    Priorité à CHECKPOINT_PG_DSN.
-    Sinon, construit dynamiquement à partir des env (mêmes que Zep ou db).
-    """
-    dsn = os.getenv("CHECKPOINT_PG_DSN")
-    if dsn:
-        return dsn
-    user = os.getenv("POSTGRES_USER", "zep")
-    pwd = os.getenv("POSTGRES_PASSWORD", "zep_password")
-    db = os.getenv("POSTGRES_DB", "zep")
-    host = os.getenv("POSTGRES_HOST", "db")
-    port = os.getenv("POSTGRES_PORT", "5432")
-    return f"postgresql://{user}:{pwd}@{host}:{port}/{db}?sslmode=disable"
-
-
-def build_graph():
-    dsn = _resolve_pg_dsn()
-    with PostgresSaver.from_conn_string(dsn) as checkpointer:
-        graph = StateGraph(GraphState)
-        graph.add_node("retrieve_memory", node_retrieve_memory)
-        graph.add_node("retrieve_docs", node_retrieve_docs)
-        graph.add_node("reason", node_reason)
-        graph.add_node("answer", node_answer)
-        graph.set_entry_point("retrieve_memory")
-        graph.add_edge("retrieve_memory", "retrieve_docs")
-        graph.add_edge("retrieve_docs", "reason")
-        graph.add_edge("reason", "answer")
-        graph.add_edge("answer", END)
-        return graph.compile(checkpointer=checkpointer)
+        return {}
+
+    last = _extract_query_from_messages(state.get("messages") or [])
+    await _remember(
+        mem,
+        [
+            {"role": "user", "content": last},
+            {"role": "assistant", "content": state["answer"]},
+        ],
+    )
+    # La réponse rejoint l'historique du thread (checkpoint)
+    return {
+        "messages": [
+            {
+                "role": "assistant",
+                "content": [{"type": "text", "text": state["answer"]}],
+            }
+        ]
+    }
+
+
+def build_graph(checkpointer: Optional[BaseCheckpointSaver] = None):
+    """
+    Compile le graphe (nœuds async : à exécuter via ainvoke/astream).
+    Le checkpointer est fourni par l'appelant, qui en gère la durée de vie.
+
+    retrieve_memory et retrieve_docs partent en parallèle depuis START ;
+    check_cache attend les deux branches (contextes fusionnés par merge_contexts)
+    et saute reason quand le cache de réponses a déjà la réponse.
+    """
+    graph = StateGraph(GraphState)
+    # Chaque nœud est mesuré (span "node", histogramme rag_span_seconds)
+    for name, fn in [
+        ("retrieve_memory", node_retrieve_memory),
+        ("retrieve_docs", node_retrieve_docs),
+        ("check_cache", node_check_cache),
+        ("reason", node_reason),
+        ("answer", node_answer),
+    ]:
+        graph.add_node(name, traced_node(name, fn))
+    graph.add_edge(START, "retrieve_memory")
+    graph.add_edge(START, "retrieve_docs")
+    graph.add_edge(["retrieve_memory", "retrieve_docs"], "check_cache")
+    graph.add_conditional_edges(
+        "check_cache", route_after_cache, {"reason": "reason", "answer": "answer"}
+    )
+    graph.add_edge("reason", "answer")
+    graph.add_edge("answer", END)
+    return graph.compile(checkpointer=checkpointer)
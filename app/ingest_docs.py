@@ -1,52 +1,683 @@
-import os, uuid, pathlib
-from typing import List
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    Distance,
+    FieldCondition,
+    Filter,
+    FilterSelector,
+    HnswConfigDiff,
+    KeywordIndexParams,
+    KeywordIndexType,
+    MatchValue,
+    OverwritePayloadOperation,
+    PointIdsList,
+    PointStruct,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SetPayload,
+    VectorParams,
+    VectorParamsDiff,
+)
+from answer_cache import get_answer_cache
+from chunking import CHUNKER_VERSION, chunk_text
+from embed_store import EmbeddingStore, get_store
+from governor import backoff_delay, is_retryable, retry_after
+from retriever import EMBED_MODEL, collection_for, embed, embed_dim
 from settings import settings
-from retriever import embed
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 DOCS_DIR = "/data/docs"
+SUFFIXES = {".txt", ".md", ".py", ".log"}
+PROGRESS_EVERY_S = 5.0
+
+# (source, chunk_hash, texte, métadonnées : offsets, section, symbole)
+Chunk = Tuple[str, str, str, Dict[str, Any]]
+
+# Espace de noms fixe : un même (projet, source, hash de chunk) donne toujours le même ID
+POINT_NAMESPACE = uuid.UUID("6f1c1d2e-4b7a-5c3e-9a1f-2d8e0b6c4a57")
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def point_id(project: str, source: str, chunk_hash: str) -> str:
+    """ID Qdrant déterministe d'un chunk (uuid5 de projet + source + hash)."""
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{project}|{source}|{chunk_hash}"))
+
 
-def load_texts() -> List[tuple[str,str]]:
-    texts = []
+def iter_files() -> Iterator[pathlib.Path]:
     for root, _, files in os.walk(DOCS_DIR):
-        for f in files:
+        for f in sorted(files):
             p = pathlib.Path(root) / f
-            if p.suffix.lower() in {".txt", ".md", ".py", ".log"}:
-                try:
-                    txt = p.read_text(encoding="utf-8", errors="ignore")
-                    step = 1000
-                    for i in range(0, len(txt), step):
-                        chunk = txt[i:i+step]
-                        if chunk.strip():
-                            texts.append((str(p), chunk.strip()))
-                except Exception:
-                    continue
-    return texts
-
-def ensure_collection(client: QdrantClient, collection: str):
+            if p.suffix.lower() in SUFFIXES:
+                yield p
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    it = iter(items)
+    while batch := list(itertools.islice(it, max(1, size))):
+        yield batch
+
+
+# === Manifest d'ingestion (un fichier JSON par projet)
+# {"project": str, "chunker": int,
+#  "files": {source: {"file_hash": str, "chunks": [chunk_hash, ...]}}}
+def _manifest_path(project: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in project)
+    return os.path.join(settings.ingest_state_dir, f"{safe}.json")
+
+
+def load_manifest(project: str) -> Dict[str, Any]:
+    path = _manifest_path(project)
+    if not os.path.exists(path):
+        return {"files": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        log.warning("Manifest illisible (%s), ingestion complète", path)
+        return {"files": {}}
+
+
+def known_projects() -> List[str]:
+    """Projets ayant un manifest d'ingestion (nom lu dans le manifest)."""
+    root = pathlib.Path(settings.ingest_state_dir)
+    if not root.is_dir():
+        return []
+    projects = set()
+    for path in root.glob("*.json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                projects.add(json.load(f).get("project") or path.stem)
+        except Exception:
+            # Manifest antérieur ou illisible : le nom de fichier est le projet
+            projects.add(path.stem)
+    return sorted(projects)
+
+
+def save_manifest(project: str, manifest: Dict[str, Any]):
+    path = _manifest_path(project)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _hnsw_config() -> Optional[HnswConfigDiff]:
+    # Mode multitenant : pas de graphe global (m=0), un graphe par valeur de
+    # "project" (payload_m) ; toutes les recherches filtrant par projet
+    if settings.qdrant_tenancy == "shared" and settings.qdrant_tenant_hnsw:
+        return HnswConfigDiff(m=0, payload_m=16)
+    return None
+
+
+def quantization_config(
+    mode: str,
+) -> Optional[Union[ScalarQuantization, BinaryQuantization]]:
+    """Quantification gardée en RAM ; les originaux servent au rescoring."""
+    if mode == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def ensure_payload_indexes(client: QdrantClient, collection: str):
+    """Index keyword sur project (tenant) et source ; idempotent."""
+    schema = client.get_collection(collection).payload_schema or {}
+    wanted = {
+        "project": KeywordIndexParams(
+            type=KeywordIndexType.KEYWORD,
+            is_tenant=settings.qdrant_tenancy == "shared",
+        ),
+        "source": KeywordIndexParams(type=KeywordIndexType.KEYWORD),
+    }
+    for field, params in wanted.items():
+        if field not in schema:
+            client.create_payload_index(collection, field, field_schema=params)
+            log.info("Index payload %s créé sur %s", field, collection)
+
+
+def ensure_collection(client: QdrantClient, collection: str) -> bool:
+    """
+    Crée la collection si besoin, avec ses index payload.
+    Retourne True si elle vient d'être créée.
+    """
     collections = [c.name for c in client.get_collections().collections]
-    if collection not in collections:
-        client.recreate_collection(
+    created = collection not in collections
+    if created:
+        client.create_collection(
             collection_name=collection,
-            vectors_config=VectorParams(size=1536, distance=Distance.COSINE)
+            vectors_config=VectorParams(
+                size=embed_dim(),
+                distance=Distance.COSINE,
+                on_disk=settings.qdrant_on_disk,
+            ),
+            hnsw_config=_hnsw_config(),
+            quantization_config=quantization_config(settings.qdrant_quantization),
         )
+    else:
+        size = client.get_collection(collection).config.params.vectors.size
+        if size != embed_dim():
+            raise ValueError(
+                f"{collection} a des vecteurs de dimension {size}, EMBED_DIMENSIONS "
+                f"demande {embed_dim()} : recréer la collection et réingérer ses "
+                "projets (python ingest_docs.py <projet> --recreate)"
+            )
+    ensure_payload_indexes(client, collection)
+    return created
 
-def ingest(project: str):
+
+def migrate() -> Dict[str, int]:
+    """
+    Met une installation existante au format courant :
+    - index payload manquants, quantification et stockage disque
+      (QDRANT_QUANTIZATION/QDRANT_ON_DISK) sur toutes les collections du projet
+    - config HNSW tenant sur la collection partagée
+    - en mode per_project, copie (vecteurs compris, sans appel API) des points
+      de la collection partagée vers une collection par projet. La collection
+      d'origine est conservée ; la supprimer une fois la bascule validée.
+    Retourne le nombre de points copiés par projet.
+    """
     client = QdrantClient(url=settings.qdrant_url)
-    ensure_collection(client, settings.qdrant_collection)
-    docs = load_texts()
-    if not docs:
-        return 0
-    payloads = [{"source": src, "text": txt, "project": project} for (src, txt) in docs]
-    vectors = embed([p["text"] for p in payloads])
-    points = [PointStruct(id=str(uuid.uuid4()), vector=v, payload=pl) for v, pl in zip(vectors, payloads)]
-    client.upsert(collection_name=settings.qdrant_collection, points=points)
-    return len(points)
+    base = settings.qdrant_collection
+    names = [c.name for c in client.get_collections().collections]
+    for name in names:
+        if name != base and not name.startswith(f"{base}__"):
+            continue
+        ensure_payload_indexes(client, name)
+        client.update_collection(
+            collection_name=name,
+            vectors_config={"": VectorParamsDiff(on_disk=settings.qdrant_on_disk)},
+            quantization_config=quantization_config(settings.qdrant_quantization)
+            or Disabled.DISABLED,
+        )
+    hnsw = _hnsw_config()
+    if hnsw is not None and base in names:
+        client.update_collection(collection_name=base, hnsw_config=hnsw)
+    if settings.qdrant_tenancy != "per_project" or base not in names:
+        return {}
+
+    copied: Dict[str, int] = {}
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=base,
+            limit=max(1, settings.ingest_upsert_batch_size),
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        by_project: Dict[str, List[PointStruct]] = {}
+        for r in records:
+            project = (r.payload or {}).get("project") or "default"
+            by_project.setdefault(project, []).append(
+                PointStruct(id=r.id, vector=r.vector, payload=r.payload)
+            )
+        for project, points in by_project.items():
+            target = collection_for(project)
+            if project not in copied:
+                ensure_collection(client, target)
+                copied[project] = 0
+            client.upsert(collection_name=target, points=points)
+            copied[project] += len(points)
+        if offset is None:
+            break
+    log.info("Migration per_project depuis %s : %s", base, copied)
+    return copied
+
+
+@dataclass
+class IngestReport:
+    project: str
+    chunks: int = 0
+    files_unchanged: int = 0
+    payloads_refreshed: int = 0
+    points_deleted: int = 0
+    embed_calls: int = 0
+    store_hits: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_s(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+
+def _scan(
+    project: str,
+    previous: Dict[str, Dict[str, Any]],
+    files: Dict[str, Dict[str, Any]],
+    stale_ids: List[str],
+    refreshed: List[Tuple[str, Dict[str, Any]]],
+    report: IngestReport,
+    full: bool,
+) -> Iterator[Chunk]:
+    """
+    Étages walk → read → chunk : produit (source, chunk_hash, texte, meta) pour les
+    chunks à (ré)embedder, un fichier à la fois. Met à jour au passage le
+    nouveau manifest (files), la liste des points à supprimer (stale_ids) et
+    celle des payloads à réécrire (refreshed) : dans un fichier modifié, un
+    chunk au texte inchangé garde son vecteur mais ses offsets, sa section ou
+    son symbole ont pu bouger.
+    """
+    for p in iter_files():
+        src = str(p)
+        prev = previous.get(src)
+        try:
+            raw = p.read_bytes()
+        except Exception:
+            # Fichier momentanément illisible : on conserve l'état connu
+            if prev:
+                files[src] = prev
+            continue
+
+        file_hash = _sha256(raw)
+        if prev and prev.get("file_hash") == file_hash and not full:
+            files[src] = prev
+            report.files_unchanged += 1
+            continue
+
+        known = set(prev.get("chunks", [])) if prev else set()
+        hashes: Dict[str, None] = {}
+        for chunk in chunk_text(raw.decode("utf-8", errors="ignore"), p.suffix):
+            h = _sha256(chunk.text.encode("utf-8"))
+            if h in hashes:
+                continue
+            hashes[h] = None
+            if full or h not in known:
+                yield src, h, chunk.text, chunk.metadata()
+            else:
+                refreshed.append(
+                    (
+                        point_id(project, src, h),
+                        _payload(project, (src, h, chunk.text, chunk.metadata())),
+                    )
+                )
+        stale_ids.extend(point_id(project, src, h) for h in known - hashes.keys())
+        files[src] = {"file_hash": file_hash, "chunks": list(hashes)}
+
+    for src in previous.keys() - files.keys():
+        stale_ids.extend(point_id(project, src, h) for h in previous[src]["chunks"])
+
+
+class EmbedScheduler:
+    """
+    Étage embed concurrent : garde plusieurs lots d'embeddings en vol
+    (workers threads), sous un budget de tokens/minute partagé.
+    Sur 429 / timeout / erreur réseau, le lot est rejoué avec backoff
+    exponentiel (Retry-After si fourni) ; un 429 suspend tous les workers.
+    Si un store local est fourni, les chunks qu'il connaît ne sont pas réembeddés.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        tpm: int,
+        max_retries: int,
+        store: Optional[EmbeddingStore] = None,
+    ):
+        self.workers = max(1, workers)
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.store = store
+        self.calls = 0
+        self.store_hits = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._tokens = float(tpm)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _acquire(self, tokens: int):
+        if self.tpm <= 0:
+            return
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._refilled_at
+                self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                self._refilled_at = now
+                delay = self._paused_until - now
+                if delay <= 0:
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    delay = (tokens - self._tokens) * 60 / self.tpm
+            time.sleep(delay)
+
+    def _call(self, texts: List[str]) -> List[List[float]]:
+        # Estimation grossière (~4 caractères par token) suffisante pour le budget
+        tokens = sum(len(t) for t in texts) // 4 + 1
+        attempt = 0
+        while True:
+            self._acquire(tokens)
+            try:
+                # Un essai par appel : retries et pause partagée gérés ici
+                vectors = embed(texts, max_retries=0)
+                with self._lock:
+                    self.calls += 1
+                return vectors
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(
+                    attempt, base_s=1.0, max_s=30.0, hint_s=retry_after(e)
+                )
+                with self._lock:
+                    self.retries += 1
+                    if getattr(e, "status_code", None) == 429:
+                        self._paused_until = max(
+                            self._paused_until, time.monotonic() + delay
+                        )
+                log.warning(
+                    "Embeddings: %s, nouvel essai %d/%d dans %.1fs",
+                    type(e).__name__,
+                    attempt + 1,
+                    self.max_retries,
+                    delay,
+                )
+                attempt += 1
+                time.sleep(delay)
+
+    def _embed(self, batch: List[Chunk]) -> Tuple[List[Chunk], List[List[float]]]:
+        # Le store local sert les chunks déjà embeddés : seuls les autres coûtent un appel
+        found = (
+            self.store.get_many(h for _, h, _, _ in batch)
+            if self.store is not None
+            else {}
+        )
+        missing = [(h, txt) for _, h, txt, _ in batch if h not in found]
+        if missing:
+            vectors = self._call([txt for _, txt in missing])
+            fresh = [(h, v) for (h, _), v in zip(missing, vectors)]
+            if self.store is not None:
+                self.store.put_many(fresh)
+            found.update(fresh)
+        with self._lock:
+            self.store_hits += len(batch) - len(missing)
+        return batch, [found[h] for _, h, _, _ in batch]
+
+    def map(
+        self, batches: Iterable[List[Chunk]]
+    ) -> Iterator[Tuple[List[Chunk], List[List[float]]]]:
+        """Embedde les lots en parallèle ; produit (lot, vecteurs) dans l'ordre d'achèvement."""
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="embed") as pool:
+            inflight: set[Future] = set()
+            for batch in batches:
+                inflight.add(pool.submit(self._embed, batch))
+                # Au plus 2 lots par worker en attente : mémoire bornée
+                if len(inflight) >= self.workers * 2:
+                    done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        yield f.result()
+            while inflight:
+                done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                for f in done:
+                    yield f.result()
+
+
+def _payload(project: str, chunk: Chunk) -> Dict[str, Any]:
+    src, h, txt, meta = chunk
+    return {"source": src, "text": txt, "project": project, "chunk_hash": h, **meta}
+
+
+def _to_points(
+    project: str, batch: List[Chunk], vectors: List[List[float]]
+) -> List[PointStruct]:
+    return [
+        PointStruct(
+            id=point_id(project, chunk[0], chunk[1]),
+            vector=v,
+            payload=_payload(project, chunk),
+        )
+        for chunk, v in zip(batch, vectors)
+    ]
+
+
+def ingest(project: str, full: bool = False) -> IngestReport:
+    """
+    Ingestion incrémentale des fichiers de DOCS_DIR pour un projet.
+    - un fichier dont le hash n'a pas changé est ignoré
+    - seuls les chunks nouveaux/modifiés sont embeddés et upsertés
+    - les points des chunks disparus (ou des fichiers supprimés) sont effacés
+    - full=True ré-embedde tout (les IDs restant stables, rien n'est dupliqué)
+
+    Pipeline en flux (walk → read → chunk → embed par lots → upsert par lots) :
+    la mémoire reste bornée par la taille des lots, pas par celle du corpus.
+    Les lots d'embeddings partent en parallèle (EmbedScheduler) et les upserts
+    Qdrant tournent dans un thread dédié, en recouvrement avec les embeddings.
+    """
+    started = time.perf_counter()
+    report = IngestReport(project=project)
+    collection = collection_for(project)
+    client = QdrantClient(url=settings.qdrant_url)
+    created = ensure_collection(client, collection)
+    if not created and not os.path.exists(_manifest_path(project)):
+        # Pas de manifest : les points existants du projet (IDs aléatoires
+        # des anciennes ingestions) sont inconnus, on repart de zéro
+        client.delete(
+            collection_name=collection,
+            points_selector=FilterSelector(
+                filter=Filter(
+                    must=[
+                        FieldCondition(key="project", match=MatchValue(value=project))
+                    ]
+                )
+            ),
+        )
+    # Collection neuve : l'ancien manifest ne décrit plus rien de réel
+    manifest = {} if created else load_manifest(project)
+    previous = manifest.get("files", {})
+    if previous and manifest.get("chunker") != CHUNKER_VERSION:
+        # Découpage modifié : tous les fichiers sont rechunkés ; les textes
+        # inchangés sont servis par le store d'embeddings, sans appel API
+        log.info(
+            "Ingestion %s: chunker v%s, rechunking complet", project, CHUNKER_VERSION
+        )
+        full = True
+
+    files: Dict[str, Dict[str, Any]] = {}
+    stale_ids: List[str] = []
+    refreshed: List[Tuple[str, Dict[str, Any]]] = []
+    upsert_size = max(1, settings.ingest_upsert_batch_size)
+    buffer: List[PointStruct] = []
+    scheduler = EmbedScheduler(
+        workers=settings.ingest_embed_workers,
+        tpm=settings.ingest_embed_tpm,
+        max_retries=settings.ingest_embed_max_retries,
+        store=get_store(EMBED_MODEL, embed_dim()),
+    )
+    # Un seul thread d'écriture : upserts/deletes ordonnés, au plus 2 en attente
+    writer = ThreadPoolExecutor(1, thread_name_prefix="upsert")
+    writes: Deque[Future] = deque()
+
+    def submit(fn, **kwargs):
+        writes.append(writer.submit(fn, collection_name=collection, **kwargs))
+        while len(writes) > 2:
+            writes.popleft().result()
+
+    def flush_upserts(size: int):
+        while len(buffer) >= size and buffer:
+            batch = buffer[:upsert_size]
+            del buffer[: len(batch)]
+            submit(client.upsert, points=batch)
+            report.chunks += len(batch)
+
+    def flush_deletes():
+        if stale_ids:
+            submit(client.delete, points_selector=PointIdsList(points=list(stale_ids)))
+            report.points_deleted += len(stale_ids)
+            stale_ids.clear()
+
+    def flush_payloads():
+        # Payload remplacé en entier : une clé disparue (section) ne subsiste pas
+        if refreshed:
+            ops = [
+                OverwritePayloadOperation(
+                    overwrite_payload=SetPayload(payload=payload, points=[pid])
+                )
+                for pid, payload in refreshed
+            ]
+            submit(client.batch_update_points, update_operations=ops)
+            report.payloads_refreshed += len(refreshed)
+            refreshed.clear()
+
+    last_progress = time.perf_counter()
+    try:
+        chunks = _scan(project, previous, files, stale_ids, refreshed, report, full)
+        batches = batched(chunks, settings.ingest_embed_batch_size)
+        for batch, vectors in scheduler.map(batches):
+            buffer.extend(_to_points(project, batch, vectors))
+            flush_upserts(upsert_size)
+            if len(stale_ids) >= upsert_size:
+                flush_deletes()
+            if len(refreshed) >= upsert_size:
+                flush_payloads()
+            if time.perf_counter() - last_progress >= PROGRESS_EVERY_S:
+                last_progress = time.perf_counter()
+                log.info(
+                    "Ingestion %s: %d chunks envoyés, %d appels embeddings, "
+                    "%d hits store, %d retries",
+                    project,
+                    report.chunks + len(buffer),
+                    scheduler.calls,
+                    scheduler.store_hits,
+                    scheduler.retries,
+                )
+        flush_upserts(1)
+        flush_deletes()
+        flush_payloads()
+        while writes:
+            writes.popleft().result()
+    finally:
+        writer.shutdown(wait=True)
+    report.embed_calls = scheduler.calls
+    report.store_hits = scheduler.store_hits
+    report.retries = scheduler.retries
+
+    save_manifest(
+        project, {"project": project, "chunker": CHUNKER_VERSION, "files": files}
+    )
+    if report.chunks or report.points_deleted:
+        # Réponses calculées sur les anciens chunks : plus valables
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(project)
+    report.seconds = time.perf_counter() - started
+    log.info(
+        "Ingestion %s: %d chunks upsertés en %.1fs (%.1f chunks/s), "
+        "%d fichiers inchangés, %d points supprimés, %d payloads réécrits, "
+        "%d appels embeddings, %d chunks servis par le store local, %d retries",
+        project,
+        report.chunks,
+        report.seconds,
+        report.chunks_per_s,
+        report.files_unchanged,
+        report.points_deleted,
+        report.payloads_refreshed,
+        report.embed_calls,
+        report.store_hits,
+        report.retries,
+    )
+    return report
+
+
+def rebuild(project: str) -> IngestReport:
+    """
+    Reconstruit les points Qdrant du projet depuis DOCS_DIR : les vecteurs
+    viennent du store local (aucun appel API pour les chunks déjà connus).
+    Utile après un reset de Qdrant ou une recréation de collection.
+    """
+    path = _manifest_path(project)
+    if os.path.exists(path):
+        os.remove(path)
+    return ingest(project, full=True)
+
+
+def recreate(project: str) -> Dict[str, IngestReport]:
+    """
+    Supprime puis recrée la collection du projet (dimension, quantification,
+    HNSW et index payload courants), puis réingère depuis DOCS_DIR. Seul
+    remède à un changement d'EMBED_DIMENSIONS. En mode shared la collection
+    est commune : tous les projets connus (manifests) sont réingérés.
+    Les vecteurs déjà calculés pour le modèle et la dimension courants
+    viennent du store local.
+    """
+    collection = collection_for(project)
+    projects = [project]
+    if settings.qdrant_tenancy != "per_project":
+        projects = sorted(set(known_projects()) | {project})
+    client = QdrantClient(url=settings.qdrant_url)
+    client.delete_collection(collection)
+    ensure_collection(client, collection)
+    log.info("Collection %s recréée, réingestion de %s", collection, projects)
+    # Manifests supprimés d'abord : ils décrivent des points qui n'existent plus
+    for p in projects:
+        path = _manifest_path(p)
+        if os.path.exists(path):
+            os.remove(path)
+    return {p: ingest(p, full=True) for p in projects}
+
 
 if __name__ == "__main__":
-    # mode CLI optionnel
+    # mode CLI optionnel :
+    # python ingest_docs.py [project] [--full|--rebuild|--recreate|--migrate]
     import sys
-    project = sys.argv[1] if len(sys.argv) > 1 else "default"
-    n = ingest(project)
-    print(f"Ingested {n} chunks into {settings.qdrant_collection} for project={project}")
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    project = args[0] if args else "default"
+    if "--migrate" in sys.argv:
+        print(f"Migrated {migrate()} (tenancy={settings.qdrant_tenancy})")
+        sys.exit(0)
+    if "--recreate" in sys.argv:
+        for p, r in recreate(project).items():
+            print(f"Recreated {collection_for(p)}: {r.chunks} chunks for project={p}")
+        sys.exit(0)
+    if "--rebuild" in sys.argv:
+        r = rebuild(project)
+    else:
+        r = ingest(project, full="--full" in sys.argv)
+    print(
+        f"Ingested {r.chunks} chunks into {collection_for(project)} "
+        f"for project={project} ({r.chunks_per_s:.1f} chunks/s, "
+        f"{r.embed_calls} embedding calls, {r.store_hits} from local store)"
+    )
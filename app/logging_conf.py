@@ -1,50 +1,155 @@
 # app/logging_conf.py
 
+import atexit
+import copy
+import json
 import logging
-import sys
+import logging.handlers
 import os
-from logging.config import dictConfig
+import queue
+import sys
+from typing import Optional
 
-from logging_filters import RequestContextFilter  # <= Import ici
+from logging_filters import (
+    REDACT_MARGIN,
+    RequestContextFilter,
+    redact_secrets,
+    truncate,
+)
+from settings import settings
 
 LOG_DIR = os.getenv("LOG_DIR", "/data/logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "app.log")
 
-def setup_logging(debug: bool = False):
-    level = "DEBUG" if debug else "INFO"
-    dictConfig({
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "format": "%(asctime)s | %(levelname)s | %(name)s | %(request_id)s | %(message)s",
-            }
-        },
-        "filters": {
-            "request_context": {
-                '()': RequestContextFilter
-            }
-        },
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "formatter": "default",
-                "filters": ["request_context"],
-                "stream": sys.stdout
-            },
-            "file": {
-                "class": "logging.handlers.RotatingFileHandler",
-                "filename": LOG_FILE,
-                "maxBytes": 10_000_000,
-                "backupCount": 3,
-                "formatter": "default",
-                "filters": ["request_context"],
-                "encoding": "utf-8"
-            },
-        },
-        "root": {
-            "level": level,
-            "handlers": ["console", "file"]
-        },
-    })
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(request_id)s | %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_TRACEBACK = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement (collecte par Loki, ELK...)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Seul handler du thread appelant : formate le message (args), le coupe à
+    max_chars plus une marge (simple découpe, sans regex), formate la
+    traceback et met l'enregistrement en file, sans I/O. File pleine :
+    l'enregistrement est perdu et compté plutôt que de bloquer la requête.
+    Masquage des secrets et troncature finale : RedactingQueueListener.
+    """
+
+    def __init__(self, q: queue.Queue, max_chars: int):
+        super().__init__(q)
+        self.max_chars = max_chars
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        message = record.getMessage()
+        limit = self.max_chars + REDACT_MARGIN
+        if self.max_chars > 0 and len(message) > limit:
+            record.msg_chars = len(message)
+            message = message[:limit]
+        record.msg = message
+        record.args = None
+        # Traceback en texte : l'objet exception ne traverse pas la file
+        if record.exc_info:
+            record.exc_text = record.exc_text or _TRACEBACK.formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RedactingQueueListener(logging.handlers.QueueListener):
+    """
+    Thread d'écriture : masque les secrets (message et traceback) une seule
+    fois par enregistrement, tronque le message à max_chars, puis le passe
+    aux handlers console et fichier.
+    """
+
+    def __init__(self, q: queue.Queue, *handlers: logging.Handler, max_chars: int):
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not hasattr(record, "request_id"):
+            record.request_id = "-"
+        # Masquage avant la coupe : un secret coupé à la limite ne serait plus
+        # reconnu ; la marge gardée par BoundedQueueHandler le contient
+        record.msg = truncate(
+            redact_secrets(record.msg),
+            self.max_chars,
+            getattr(record, "msg_chars", None),
+        )
+        if record.exc_text:
+            record.exc_text = redact_secrets(record.exc_text)
+        return record
+
+
+def setup_logging(level: Optional[str] = None, json_format: Optional[bool] = None):
+    """
+    Pipeline non bloquant : les loggers écrivent dans une file (QueueHandler),
+    un thread (RedactingQueueListener) masque les secrets, tronque les
+    messages et écrit console + fichier.
+    Niveau et format : LOG_LEVEL / LOG_JSON par défaut.
+    """
+    global _listener
+    level = (level or settings.log_level).upper()
+    json_format = settings.log_json if json_format is None else json_format
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+
+    console = logging.StreamHandler(sys.stdout)
+    file = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=10_000_000, backupCount=3, encoding="utf-8"
+    )
+    for handler in (console, file):
+        handler.setFormatter(formatter)
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+    queue_handler = BoundedQueueHandler(log_queue, settings.log_max_message_chars)
+    queue_handler.addFilter(RequestContextFilter())
+    _listener = RedactingQueueListener(
+        log_queue, console, file, max_chars=settings.log_max_message_chars
+    )
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+
+@atexit.register
+def _stop_listener():
+    # Vide la file avant la sortie du process
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
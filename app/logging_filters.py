@@ -3,28 +3,56 @@
 import contextvars
 import logging
 import re
+from typing import Optional
 
 # Variable de contexte pour suivre l’ID de requête
 _request_id_ctx = contextvars.ContextVar("request_id", default="-")
 
+# Motifs de secrets, compilés une fois pour toutes
+_SECRET_PATTERNS = [
+    re.compile(r"(sk-[A-Za-z0-9_-]{20,})"),  # OpenAI
+    re.compile(r"(?i)authorization:\s*Bearer\s+\S+"),
+    re.compile(r"(?i)api[_-]?key[=:]\s*\S+"),
+]
+
+# Caractères gardés au-delà de la limite avant masquage : un secret à cheval
+# sur la coupe reste reconnaissable
+REDACT_MARGIN = 256
+
+
 # Appelle ceci pour lier l’ID de requête au contexte courant
 def set_request_id(rid: str):
     _request_id_ctx.set(rid)
 
+
+def get_request_id() -> str:
+    return _request_id_ctx.get()
+
+
 class RequestContextFilter(logging.Filter):
+    """
+    Côté thread appelant (avant la file de logs) : capture le request_id,
+    qui n'existe que dans le contexte de la requête. Rien d'autre : le
+    masquage des secrets se fait une seule fois, dans le thread d'écriture.
+    """
+
     def filter(self, record: logging.LogRecord) -> bool:
         record.request_id = _request_id_ctx.get()
-        # Nettoyage des infos sensibles
-        record.msg = redact_secrets(str(record.getMessage()))
-        record.args = ()
         return True
 
+
 def redact_secrets(message: str) -> str:
-    patterns = [
-        re.compile(r"(sk-[A-Za-z0-9]{20,})"),  # OpenAI
-        re.compile(r"(?i)authorization:\s*Bearer\s+\S+"),
-        re.compile(r"(?i)api[_-]?key[=:]\s*\S+")
-    ]
-    for pat in patterns:
+    for pat in _SECRET_PATTERNS:
         message = pat.sub("[REDACTED]", message)
     return message
+
+
+def truncate(message: str, max_chars: int, total: Optional[int] = None) -> str:
+    """
+    Coupe les messages trop longs (payloads, contextes) en signalant la coupe.
+    total : longueur d'origine, si message en est déjà un préfixe.
+    """
+    total = len(message) if total is None else total
+    if max_chars <= 0 or total <= max_chars:
+        return message
+    return f"{message[:max_chars]}… [{total - max_chars} caractères tronqués]"
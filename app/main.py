@@ -1,34 +1,62 @@
+# Premier import : date le début du chargement de l'app (import_s)
+import boot  # isort: skip
+
 # ... imports standards ...
+import asyncio
 import json
 import logging
 import os
+import time
 import uuid
-from typing import Any, Dict, List, Optional
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
-import debugpy
 import uvicorn
 from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from pydantic import BaseModel
 
-import psycopg
-from psycopg_pool import ConnectionPool
-
-from langgraph.checkpoint.postgres import PostgresSaver
-
-from graph import build_graph
-from ingest_docs import ingest as ingest_qdrant
+from answer_cache import get_answer_cache
+from attachments import AttachmentError, get_attachment_store
+from checkpoint import (
+    aping,
+    open_async_checkpointer,
+    pool_stats,
+    redact_dsn,
+    resolve_pg_dsn,
+)
+from context_budget import count_tokens
+from embed_cache import get_query_cache
+from governor import Overloaded, governor_stats
+from graph import build_graph, docs_retriever
 from logging_conf import setup_logging
+from memory import (
+    aclose_clients as aclose_zep_clients,
+    awarmup as awarmup_zep,
+    memory_stats,
+    zep_stats,
+)
+from memory_queue import get_memory_queue
 from logging_filters import set_request_id
+from metrics import (
+    Trace,
+    defer_trace,
+    finish_trace,
+    register_stats,
+    render,
+    start_trace,
+)
 from settings import settings
+from singleflight import get_singleflight
+from turn_buffer import get_turn_buffer
 
-# === Debugger (VS Code / DevContainer)
-debugpy.listen(("0.0.0.0", 5678))
-print("✅ Debugger is listening on port 5678")
-
-# === Logging
-setup_logging(debug=True)
 log = logging.getLogger("app")
-log.info("Application startup - logging system initialized")
 
 # === FastAPI App
 app = FastAPI(title="LangGraph+Zep+Qdrant (Projects)")
@@ -38,86 +66,181 @@ app = FastAPI(title="LangGraph+Zep+Qdrant (Projects)")
 async def inject_request_id(request: Request, call_next):
     rid = request.headers.get("x-request-id") or str(uuid.uuid4())
     set_request_id(rid)
-    response = await call_next(request)
+    # Trace de la requête : spans des nœuds et appels amont, corrélés au request_id
+    trace = start_trace(request.method)
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish_trace(trace, 500)
+        raise
+    # Chemin de la route (/attachments/{att_id}) plutôt que l'URL : labels bornés
+    route = request.scope.get("route")
+    trace.route = f"{request.method} {getattr(route, 'path', 'unmatched')}"
+    if not trace.deferred:
+        finish_trace(trace, response.status_code)
     response.headers["x-request-id"] = rid
     return response
 
 
-# === Typing
-GraphState = Dict[str, Any]
-
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Rejet rapide d'un service amont saturé : le client réessaie plus tard
+    log.warning("Requête rejetée (%d): %s", exc.status, exc)
+    return JSONResponse(
+        status_code=exc.status,
+        content={"detail": str(exc), "upstream": exc.upstream},
+        headers={"Retry-After": exc.retry_after_header},
+    )
 
-# === Helpers
-def _env(key: str, default: Optional[str] = None) -> Optional[str]:
-    val = getattr(settings, key.lower(), None)
-    return val or os.getenv(key, default)
 
-
-def _redact_dsn(dsn: str) -> str:
-    try:
-        if "://" in dsn and "@" in dsn:
-            scheme, rest = dsn.split("://", 1)
-            userpass, host = rest.split("@", 1)
-            user = userpass.split(":")[0]
-            return f"{scheme}://{user}:***@{host}"
-    except Exception:
-        pass
-    return dsn
+# === Métriques : les compteurs de /health sont aussi publiés dans /metrics
+def _stats_of(component: Any) -> Optional[Dict[str, Any]]:
+    return component.stats() if component is not None else None
 
 
-def resolve_pg_dsn() -> str:
-    dsn = _env("CHECKPOINT_PG_DSN") or _env("POSTGRES_DSN")
-    if dsn:
-        return dsn
-    user = _env("POSTGRES_USER", "zep")
-    pwd = _env("POSTGRES_PASSWORD", "zep_password")
-    db = _env("POSTGRES_DB", "zep")
-    host = _env("POSTGRES_HOST", "db")
-    port = _env("POSTGRES_PORT", "5432")
-    return f"postgresql://{user}:{pwd}@{host}:{port}/{db}?sslmode=disable"
+register_stats("checkpoint_pool", pool_stats, label="pool")
+register_stats("query_embed_cache", lambda: _stats_of(get_query_cache()))
+register_stats("zep_latency", zep_stats.stats, label="op")
+register_stats("zep_write_queue", lambda: _stats_of(get_memory_queue()))
+register_stats("turn_buffer", lambda: _stats_of(get_turn_buffer()))
+register_stats("answer_cache", lambda: _stats_of(get_answer_cache()))
+register_stats("upstream", governor_stats, label="upstream")
+register_stats("singleflight", lambda: _stats_of(get_singleflight()))
+register_stats("startup", lambda: _startup_stats())
 
 
-def ping_postgres(dsn: str) -> bool:
-    try:
-        with psycopg.connect(dsn, connect_timeout=3) as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1")
-                _ = cur.fetchone()
-        log.debug("✅ Postgres ping OK (%s)", _redact_dsn(dsn))
-        return True
-    except Exception as e:
-        log.error("❌ Postgres ping KO (%s): %s", _redact_dsn(dsn), e)
-        return False
+# === Typing
+GraphState = Dict[str, Any]
 
 
 # === Globals
 _GRAPH = None
-_DSN = resolve_pg_dsn()
+_DSN: Optional[str] = None
+# Ressources async ouvertes au démarrage, fermées à l'arrêt
+_RESOURCES = AsyncExitStack()
+# Durées des phases du démarrage (secondes) et résultat du warmup : cf. /ready
+_STARTUP: Dict[str, float] = {}
+_WARMUP: Optional[Dict[str, Dict[str, Any]]] = None
+_READY = False
+
 
+def _dsn() -> str:
+    # Résolu au premier usage (démarrage), pas à l'import
+    global _DSN
+    if _DSN is None:
+        _DSN = resolve_pg_dsn()
+    return _DSN
 
-def init_graph_once():
+
+async def init_graph_once():
     global _GRAPH
     if _GRAPH is not None:
         return _GRAPH
 
-    log.info("🔁 Initialisation du PostgresSaver avec DSN")
+    log.info("🔁 Initialisation du AsyncPostgresSaver (pool partagé)")
     try:
-        with PostgresSaver.from_conn_string(_DSN) as checkpointer:
-            compiled = build_graph()
-            _GRAPH = compiled.with_config(checkpointer=checkpointer)
-            log.info("✅ Graphe initialisé avec checkpoint Postgres")
-            return _GRAPH
+        checkpointer = await open_async_checkpointer(_RESOURCES, _dsn())
+        _GRAPH = build_graph(checkpointer=checkpointer)
+        log.info("✅ Graphe initialisé avec checkpoint Postgres")
+        return _GRAPH
     except Exception as e:
         log.exception("❌ Échec d'initialisation du graphe: %s", e)
         raise HTTPException(status_code=500, detail="Graph initialization failed")
 
 
+async def _ping_postgres():
+    if not await aping(_dsn()):
+        raise RuntimeError("SELECT 1 failed")
+
+
+async def _warmup_step(name: str, fn: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(fn(), settings.startup_warmup_timeout_s)
+        status = "ok"
+    except Exception as e:
+        status = f"error: {type(e).__name__}"
+        log.warning("⚠️ Warmup %s en échec (%s): %s", name, type(e).__name__, e)
+    return {"status": status, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+async def warmup() -> Dict[str, Dict[str, Any]]:
+    """
+    Ouvre les connexions avant le premier trafic (étapes en parallèle, bornées
+    par STARTUP_WARMUP_TIMEOUT_S) : pool Postgres du checkpointer, client
+    Qdrant async, client Zep async, tokenizer du modèle de génération.
+    Un échec est loggé et reporté dans /ready sans bloquer le démarrage :
+    le service concerné sera réessayé à la première requête.
+    """
+    steps: Dict[str, Callable[[], Awaitable[Any]]] = {
+        "postgres": _ping_postgres,
+        "qdrant": docs_retriever.awarmup,
+        "zep": awarmup_zep,
+        "tokenizer": lambda: run_in_threadpool(count_tokens, "warmup"),
+    }
+    results = await asyncio.gather(*(_warmup_step(n, f) for n, f in steps.items()))
+    return dict(zip(steps, results))
+
+
+def _startup_stats() -> Dict[str, Any]:
+    return {**{k: round(v, 3) for k, v in _STARTUP.items()}, "ready": int(_READY)}
+
+
+def _start_debugger():
+    # VS Code / DevContainer, sur demande : DEBUGPY_ENABLED=true
+    import debugpy
+
+    debugpy.listen(("0.0.0.0", settings.debugpy_port))
+    log.info("✅ Debugger is listening on port %d", settings.debugpy_port)
+
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
+    """
+    Settings, logs, debugger, graphe et warmup : rien de tout cela à l'import.
+    Durées rapportées : import_s (de l'import de boot, premier module chargé,
+    jusqu'à ce hook : imports et mise en route d'uvicorn), puis init_s,
+    warmup_s et startup_s mesurées ici. Détail par module :
+    python -X importtime main.py.
+    """
+    global _WARMUP, _READY
+    started = time.perf_counter()
+    _STARTUP["import_s"] = started - boot.IMPORT_STARTED
+    setup_logging()
+    log.info("Application startup - logging system initialized")
+    if settings.debugpy_enabled:
+        _start_debugger()
     log.info(
         "🚀 Application startup: initializing LangGraph with Postgres checkpointing"
     )
-    init_graph_once()
+    await init_graph_once()
+    # Clients Zep partagés : connexions keep-alive fermées à l'arrêt
+    _RESOURCES.push_async_callback(aclose_zep_clients)
+    # Écritures Zep différées ; vidées à l'arrêt, avant la fermeture des clients
+    queue = get_memory_queue()
+    if queue is not None:
+        queue.start()
+        _RESOURCES.push_async_callback(queue.drain)
+    _STARTUP["init_s"] = time.perf_counter() - started
+    # Uvicorn n'accepte le trafic qu'après ce hook : le warmup le précède
+    if settings.startup_warmup:
+        warmup_started = time.perf_counter()
+        _WARMUP = await warmup()
+        _STARTUP["warmup_s"] = time.perf_counter() - warmup_started
+    _STARTUP["startup_s"] = time.perf_counter() - started
+    _READY = True
+    log.info(
+        "✅ Prêt : import %.2f s, démarrage %.2f s (init %.2f s), warmup %s",
+        _STARTUP["import_s"],
+        _STARTUP["startup_s"],
+        _STARTUP["init_s"],
+        {k: v["status"] for k, v in (_WARMUP or {}).items()} or "désactivé",
+    )
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await _RESOURCES.aclose()
 
 
 # === Auth + Storage
@@ -126,6 +249,26 @@ def _auth(x_api_key: str | None):
         raise HTTPException(status_code=401, detail="Invalid API key")
 
 
+def _summarize_messages(messages: List[Dict[str, Any]]) -> List[str]:
+    """Résumé loggable d'un tour : rôles et types de parts, jamais le contenu."""
+    out = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            parts = ",".join(
+                (
+                    f"text({len(p.get('text') or '')})"
+                    if p.get("type") == "text"
+                    else f"image({(p.get('ref') or 'inline')[:12]})"
+                )
+                for p in content
+            )
+        else:
+            parts = f"text({len(str(content or ''))})"
+        out.append(f"{m.get('role')}:{parts}")
+    return out
+
+
 def _load_projects() -> List[Dict[str, str]]:
     if not os.path.exists(settings.projects_file):
         return []
@@ -157,26 +300,59 @@ class Query(BaseModel):
 class ChatPayload(BaseModel):
     session_id: str
     project: Optional[str] = "default"
+    # Nouveaux messages du tour seulement : l'historique est dans le checkpoint
     messages: List[Dict[str, Any]]
     thread_id: str
 
 
 class IngestReq(BaseModel):
     project: Optional[str] = "default"
+    full: bool = False
 
 
 # === Routes
+@app.get("/ready")
+async def ready():
+    """
+    Readiness (load balancer, orchestrateur) : 503 tant que le graphe n'est pas
+    initialisé et le warmup terminé. /health reste la sonde de vie détaillée.
+    """
+    ok = _READY and _GRAPH is not None
+    body = {**_startup_stats(), "ready": ok, "warmup": _WARMUP}
+    return JSONResponse(status_code=200 if ok else 503, content=body)
+
+
 @app.get("/health")
-def health():
-    ok = ping_postgres(_DSN)
+async def health():
+    ok = await aping(_dsn())
+    qcache = get_query_cache()
+    wqueue = get_memory_queue()
+    tbuffer = get_turn_buffer()
+    acache = get_answer_cache()
+    flights = get_singleflight()
     return {
         "status": "ok",
         "postgres": "ok" if ok else "down",
-        "checkpoint_dsn": _redact_dsn(_DSN),
+        "checkpoint_dsn": redact_dsn(_dsn()),
+        "checkpoint_pool": pool_stats(),
         "graph_ready": _GRAPH is not None,
+        "startup": _startup_stats(),
+        "query_embed_cache": qcache.stats() if qcache else None,
+        "zep": memory_stats(),
+        "zep_write_queue": wqueue.stats() if wqueue else None,
+        "turn_buffer": tbuffer.stats() if tbuffer else None,
+        "answer_cache": acache.stats() if acache else None,
+        "upstreams": governor_stats(),
+        "singleflight": flights.stats() if flights else None,
     }
 
 
+@app.get("/metrics")
+def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/projects")
 def list_projects(x_api_key: str | None = Header(default=None)):
     _auth(x_api_key)
@@ -194,73 +370,251 @@ def create_project(p: ProjectCreate, x_api_key: str | None = Header(default=None
     return {"ok": True}
 
 
-@app.post("/ask")
-def ask(q: Query, x_api_key: str | None = Header(default=None)):
-    _auth(x_api_key)
-    if _GRAPH is None:
-        raise HTTPException(status_code=503, detail="Graph not initialized")
-    state: GraphState = {
+def _ask_thread(q: Query) -> str:
+    # Un fil de checkpoint par (projet, session) : le checkpointer l'exige
+    return f"ask::{q.project or 'default'}::{q.session_id}"
+
+
+def _ask_state(q: Query) -> GraphState:
+    return {
         "session_id": q.session_id,
         "project": q.project or "default",
         "question": q.question,
         "messages": [],
-        "context": [],
+        "contexts": {},
+        "doc_ids": [],
         "answer": "",
-        "thread_id": "default",
+        "prompt_context": "",
+        "prompt_memory": 0,
+        "cached": False,
+        "thread_id": _ask_thread(q),
         "user_id": "fred",
     }
 
+
+def _chat_state(payload: ChatPayload) -> GraphState:
+    return {
+        "session_id": payload.session_id,
+        "project": payload.project or "default",
+        "question": None,
+        "messages": payload.messages,
+        "contexts": {},
+        "doc_ids": [],
+        "answer": "",
+        "prompt_context": "",
+        "prompt_memory": 0,
+        "cached": False,
+        "thread_id": payload.thread_id,
+        "user_id": "fred",
+    }
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_graph(
+    state: GraphState, thread_id: str, trace: Optional[Trace] = None
+) -> AsyncIterator[str]:
+    """
+    Exécute le graphe et le traduit en Server-Sent Events :
+    - token : fragment de réponse du LLM (flux "custom" émis par node_reason)
+    - node  : fin d'un nœud du graphe (flux "updates")
+    - done  : réponse complète (cached=True si servie par le cache de réponses),
+              après l'écriture mémoire de node_answer
+    - error : échec en cours de flux (le statut HTTP est déjà parti) ; pour un
+              service saturé, status (429/503) et retry_after en secondes
+    """
+    answer, cached = "", False
+    try:
+        async for mode, chunk in _GRAPH.astream(  # type: ignore
+            state,
+            config={"configurable": {"thread_id": thread_id}},
+            stream_mode=["custom", "updates"],
+        ):
+            if mode == "custom":
+                if isinstance(chunk, dict) and chunk.get("type") == "token":
+                    yield _sse("token", {"text": chunk["text"]})
+                continue
+            for node, update in chunk.items():
+                # Réponse produite par reason, ou par check_cache en cas de hit
+                if update and update.get("answer"):
+                    answer = update["answer"]
+                    cached = bool(update.get("cached"))
+                yield _sse("node", {"node": node})
+        yield _sse("done", {"answer": answer, "cached": cached})
+    except Overloaded as e:
+        log.warning("Graph stream rejected (%d): %s", e.status, e)
+        yield _sse(
+            "error",
+            {"detail": str(e), "status": e.status, "retry_after": e.retry_after_s},
+        )
+    except Exception as e:
+        log.exception(f"Graph stream failed: {e}")
+        yield _sse("error", {"detail": str(e)})
+    finally:
+        finish_trace(trace, 200)
+
+
+def _sse_response(state: GraphState, thread_id: str) -> StreamingResponse:
+    # La trace de la requête se termine avec le flux, pas à l'envoi des en-têtes
+    trace = defer_trace()
+    return StreamingResponse(
+        _stream_graph(state, thread_id, trace),
+        media_type="text/event-stream",
+        # Pas de mise en tampon côté proxy (nginx) : les tokens partent tout de suite
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask")
+async def ask(q: Query, x_api_key: str | None = Header(default=None)):
+    _auth(x_api_key)
+    if _GRAPH is None:
+        raise HTTPException(status_code=503, detail="Graph not initialized")
+    thread_id = _ask_thread(q)
+    state = _ask_state(q)
+
     try:
-        result = _GRAPH.invoke(state)  # type: ignore
+        result = await _GRAPH.ainvoke(  # type: ignore
+            state, config={"configurable": {"thread_id": thread_id}}
+        )
         ans = result.get("answer", "")
         log.info(f"Q[{q.project}/{q.session_id}]: {q.question}")
-        return {"answer": ans}
+        return {"answer": ans, "cached": bool(result.get("cached"))}
+    except Overloaded:
+        raise
     except Exception as e:
         log.exception(f"Invoke failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ask/stream")
+async def ask_stream(q: Query, x_api_key: str | None = Header(default=None)):
+    _auth(x_api_key)
+    if _GRAPH is None:
+        raise HTTPException(status_code=503, detail="Graph not initialized")
+    log.info(f"Q[{q.project}/{q.session_id}] (stream): {q.question}")
+    return _sse_response(_ask_state(q), _ask_thread(q))
+
+
 @app.post("/chat")
-def chat(payload: ChatPayload, x_api_key: str | None = Header(default=None)):
+async def chat(payload: ChatPayload, x_api_key: str | None = Header(default=None)):
     _auth(x_api_key)
-    log.debug(f"Received chat payload: {payload}")
+    log.debug(
+        "Chat payload: thread=%s project=%s messages=%s",
+        payload.thread_id,
+        payload.project,
+        _summarize_messages(payload.messages),
+    )
     if _GRAPH is None:
         raise HTTPException(status_code=503, detail="Graph not initialized")
-    state: GraphState = {
-        "session_id": payload.session_id,
-        "project": payload.project or "default",
-        "question": None,
-        "messages": payload.messages,
-        "context": [],
-        "answer": "",
-        "thread_id": payload.thread_id,
-        "user_id": "fred",
-    }
+    state = _chat_state(payload)
 
-    ans = None
+    ans, cached = None, False
     try:
-        for update in _GRAPH.stream(  # type: ignore
+        async for update in _GRAPH.astream(  # type: ignore
             state,
             config={"configurable": {"thread_id": payload.thread_id}},
             stream_mode="updates",
         ):
-            if isinstance(update, dict) and "answer" in update:
-                ans = update["answer"]
-                log.debug({"event": "graph_final", "answer": ans})
+            # Mode "updates" : {nom_du_noeud: mise_à_jour_partielle}
+            # La réponse vient de reason, ou de check_cache en cas de hit ;
+            # answer ne fait que l'archiver
+            node, upd = next(iter(update.items()))
+            if upd and upd.get("answer"):
+                ans, cached = upd["answer"], bool(upd.get("cached"))
+                log.debug("Graph final: %s (%d caractères)", node, len(ans))
             else:
-                log.debug({"event": "graph_step", "update": update})
+                # Clés mises à jour seulement : ni contextes ni messages dans les logs
+                log.debug("Graph step: %s %s", node, sorted(upd or {}))
+    except Overloaded:
+        raise
     except Exception as e:
         log.exception(f"Graph execution failed: {e}")
         raise HTTPException(status_code=500, detail=f"Graph error: {e}")
 
-    return {"answer": ans or ""}
+    return {"answer": ans or "", "cached": cached}
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    payload: ChatPayload, x_api_key: str | None = Header(default=None)
+):
+    _auth(x_api_key)
+    if _GRAPH is None:
+        raise HTTPException(status_code=503, detail="Graph not initialized")
+    return _sse_response(_chat_state(payload), payload.thread_id)
+
+
+@app.post("/attachments")
+async def upload_attachment(
+    request: Request, x_api_key: str | None = Header(default=None)
+):
+    """
+    Corps brut = contenu du fichier, Content-Type = type MIME de l'image.
+    Retourne l'identifiant (sha256) à référencer dans les messages :
+    {"type": "image", "ref": <id>}.
+    """
+    _auth(x_api_key)
+    store = get_attachment_store()
+    too_large = HTTPException(
+        status_code=413, detail=f"Attachment exceeds {store.max_bytes} bytes"
+    )
+    if int(request.headers.get("content-length") or 0) > store.max_bytes:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > store.max_bytes:
+            raise too_large
+    try:
+        att = await run_in_threadpool(
+            store.put, bytes(body), request.headers.get("content-type", "")
+        )
+    except AttachmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": att.id, "mime": att.mime, "size": att.size}
+
+
+@app.get("/attachments/{att_id}")
+def get_attachment(att_id: str, x_api_key: str | None = Header(default=None)):
+    _auth(x_api_key)
+    try:
+        att = get_attachment_store().get(att_id)
+    except AttachmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if att is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    # Contenu adressé par hash : immuable, cacheable sans limite
+    return FileResponse(
+        att.path,
+        media_type=att.mime,
+        headers={"Cache-Control": "private, max-age=31536000, immutable"},
+    )
 
 
 @app.post("/ingest")
 def ingest(req: IngestReq, x_api_key: str | None = Header(default=None)):
     _auth(x_api_key)
-    n = ingest_qdrant(project=req.project or "default")
-    return {"status": "ingested", "chunks": n, "project": req.project or "default"}
+    # Import à la demande : l'ingestion (chunking, planificateur d'embeddings)
+    # ne sert qu'à cet endpoint
+    from ingest_docs import ingest as ingest_qdrant
+
+    report = ingest_qdrant(project=req.project or "default", full=req.full)
+    return {
+        "status": "ingested",
+        "chunks": report.chunks,
+        "project": report.project,
+        "files_unchanged": report.files_unchanged,
+        "points_deleted": report.points_deleted,
+        "payloads_refreshed": report.payloads_refreshed,
+        "embed_calls": report.embed_calls,
+        "store_hits": report.store_hits,
+        "retries": report.retries,
+        "seconds": round(report.seconds, 2),
+        "chunks_per_s": round(report.chunks_per_s, 1),
+    }
 
 
 # === Launch
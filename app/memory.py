@@ -1,45 +1,265 @@
-from zep_python.client import Zep
-from zep_python import RoleType
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+
+import httpx
+from zep_python import Message
+from zep_python.client import AsyncZep
+from zep_python.core.api_error import ApiError
+from governor import acall
 from settings import settings
-from typing import List, Dict
 
-import logging
 log = logging.getLogger(__name__)
 log.debug("Je suis dans memory.py")
 
-class ZepMemory:
+
+class ZepStats:
+    """Latence des appels Zep par opération (fenêtre glissante pour p50/p95)."""
+
+    WINDOW = 512
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops: Dict[str, Dict[str, float]] = {}
+        self._samples: Dict[str, Deque[float]] = {}
+
+    @contextmanager
+    def timed(self, op: str):
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                entry = self._ops.setdefault(
+                    op, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+                )
+                entry["calls"] += 1
+                entry["errors"] += failed
+                entry["total_ms"] += ms
+                entry["max_ms"] = max(entry["max_ms"], ms)
+                self._samples.setdefault(op, deque(maxlen=self.WINDOW)).append(ms)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out = {}
+            for op, e in self._ops.items():
+                samples = sorted(self._samples[op])
+                out[op] = {
+                    "calls": e["calls"],
+                    "errors": e["errors"],
+                    "avg_ms": round(e["total_ms"] / e["calls"], 1),
+                    "p50_ms": round(samples[len(samples) // 2], 1),
+                    "p95_ms": round(
+                        samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1
+                    ),
+                    "max_ms": round(e["max_ms"], 1),
+                }
+            return out
+
+
+zep_stats = ZepStats()
+
+
+class _KnownUsers:
+    """
+    Registre LRU des sessions déjà enregistrées dans Zep (utilisateur et
+    session du même ID) : user.add et add_session ne sont appelés qu'une fois
+    par session et par process.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        # None : ZEP_KNOWN_USERS_MAX, lu au premier ajout
+        self.max_entries = max_entries
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            if user_id in self._ids:
+                self._ids.move_to_end(user_id)
+                return True
+            return False
+
+    def add(self, user_id: str):
+        with self._lock:
+            self._ids[user_id] = None
+            self._ids.move_to_end(user_id)
+            limit = self.max_entries or settings.zep_known_users_max
+            while len(self._ids) > limit:
+                self._ids.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+known_users = _KnownUsers()
+
+
+def _user_exists(e: Exception) -> bool:
+    # Zep répond 400/409 quand l'utilisateur (ou la session) existe déjà
+    return isinstance(e, ApiError) and e.status_code in (400, 409)
+
+
+def _zep_messages(messages: List[Dict[str, str]]) -> List[Message]:
+    out = []
+    for m in messages:
+        role = "user" if m["role"] == "user" else "assistant"
+        out.append(Message(role=role, role_type=role, content=m["content"]))
+    return out
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.zep_max_connections,
+        max_keepalive_connections=settings.zep_max_keepalive,
+    )
+
+
+# Client Zep partagé par le process : connexions HTTP réutilisées (keep-alive)
+_azep: Optional[AsyncZep] = None
+_ahttp: Optional[httpx.AsyncClient] = None
+_clients_lock = threading.Lock()
+
+
+def get_async_zep() -> AsyncZep:
+    global _azep, _ahttp
+    with _clients_lock:
+        if _azep is None:
+            _ahttp = httpx.AsyncClient(limits=_limits(), timeout=settings.zep_timeout_s)
+            _azep = AsyncZep(
+                base_url=settings.zep_api_url,
+                api_key=settings.zep_api_key,
+                timeout=settings.zep_timeout_s,
+                httpx_client=_ahttp,
+            )
+        return _azep
+
+
+async def awarmup():
+    """
+    Crée le client async partagé et ouvre une connexion keep-alive vers Zep
+    (GET /healthz), avant la première requête utilisateur.
+    """
+    get_async_zep()
+    res = await _ahttp.get(  # type: ignore[union-attr]
+        f"{settings.zep_api_url.rstrip('/')}/healthz"
+    )
+    res.raise_for_status()
+
+
+async def aclose_clients():
+    """Ferme les connexions HTTP du client partagé (arrêt de l'app)."""
+    global _azep, _ahttp
+    with _clients_lock:
+        ahttp = _ahttp
+        _azep = _ahttp = None
+    if ahttp is not None:
+        await ahttp.aclose()
+
+
+def memory_stats() -> Dict[str, object]:
+    return {"latency": zep_stats.stats(), "known_users": len(known_users)}
+
+
+class AsyncZepMemory:
+    """
+    Mémoire Zep d'une session (client AsyncZep) pour le chemin des requêtes.
+    L'enregistrement de l'utilisateur est explicite : await mem.ensure_user().
+    Construction sans coût : le client AsyncZep est partagé par le process.
+    """
+
     def __init__(self, session_id: str, project: str | None):
         self.session_id = f"{project or 'default'}::{session_id}"
-        self.client = Zep(
-            base_url=settings.zep_api_url,  # Peut être None si ZEP_API_URL est dans l'env
-            api_key=settings.zep_api_key    # Peut être None si ZEP_API_KEY est dans l'env
-        )
+        self.client = get_async_zep()
+
+    async def ensure_user(self) -> bool:
+        """Retourne True si la session vient d'être créée (aucun historique Zep)."""
+        if self.session_id in known_users:
+            return False
         try:
-            # add() accepte un dictionnaire directement
-            self.client.user.add({"user_id": self.session_id})
-        except Exception:
-            pass
-
-    def add_messages(self, messages: List[Dict[str, str]]):
-        zep_msgs = [
-            {
-                "role": "user" if m["role"] == "user" else "assistant",
-                "content": m["content"]
-            }
-            for m in messages
-        ]
-        self.client.memory.add_messages(
-            session_id=self.session_id,
-            messages=zep_msgs,
-            memory_type="chat"
-        )
-
-    def retrieve_context(self, limit: int = 6) -> List[str]:
-        payload = {
-            "session_id": self.session_id,
-            "memory_type": "chat",
-            "search_scope": "messages",
-            "top_k": limit
-        }
-        response = self.client.memory.search_memory(payload)
-        return [msg.content for msg in response.messages]
+            with zep_stats.timed("user.add"):
+                await self._add_once(
+                    lambda: self.client.user.add(user_id=self.session_id), "user.add"
+                )
+            with zep_stats.timed("add_session"):
+                created = await self._add_once(
+                    lambda: self.client.memory.add_session(
+                        session_id=self.session_id, user_id=self.session_id
+                    ),
+                    "add_session",
+                )
+            known_users.add(self.session_id)
+            return created
+        except Exception as e:
+            log.warning("Enregistrement Zep de %s échoué: %s", self.session_id, e)
+            return False
+
+    @staticmethod
+    async def _add_once(fn, op: str) -> bool:
+        """True si créé, False si déjà présent dans Zep."""
+        try:
+            await acall("zep", fn, op=op)
+            return True
+        except Exception as e:
+            if not _user_exists(e):
+                raise
+            return False
+
+    async def add_messages(
+        self, messages: List[Dict[str, str]], max_retries: Optional[int] = None
+    ):
+        """max_retries=0 : un seul essai (la file d'écriture gère ses retries)."""
+        zep_msgs = _zep_messages(messages)
+        with zep_stats.timed("memory.add"):
+            await acall(
+                "zep",
+                lambda: self.client.memory.add(self.session_id, messages=zep_msgs),
+                max_retries,
+                op="memory.add",
+            )
+
+    async def recent_messages(self, limit: int = 6) -> List[str]:
+        """
+        Derniers messages de la session, du plus ancien au plus récent : seule
+        source valable pour amorcer le buffer des derniers tours.
+        """
+        with zep_stats.timed("memory.get"):
+            memory = await acall(
+                "zep",
+                lambda: self.client.memory.get(self.session_id, lastn=limit),
+                op="memory.get",
+            )
+        return [m.content for m in memory.messages or [] if m.content]
+
+    async def search_context(self, query: str, limit: int = 6) -> List[str]:
+        """
+        Messages (ou faits, selon l'édition de Zep) de la session pertinents
+        pour query, par score décroissant. Recherche sémantique : sert à
+        l'historique plus ancien que les derniers tours, jamais à ces derniers.
+        """
+        with zep_stats.timed("search_sessions"):
+            response = await acall(
+                "zep",
+                lambda: self.client.memory.search_sessions(
+                    text=query,
+                    session_ids=[self.session_id],
+                    search_scope="messages",
+                    limit=limit,
+                ),
+                op="search_sessions",
+            )
+        lines = []
+        for r in response.results or []:
+            if r.message is not None and r.message.content:
+                lines.append(r.message.content)
+            elif r.fact is not None and r.fact.fact:
+                lines.append(r.fact.fact)
+        return lines
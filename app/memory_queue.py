@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from governor import Overloaded, backoff_delay, is_retryable, retry_after
+from memory import AsyncZepMemory
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+
+class MemoryWriteQueue:
+    """
+    File d'écriture différée (write-behind) des tours de conversation vers Zep.
+    - enqueue() rend la main tout de suite : la réponse n'attend plus Zep
+    - les messages en attente d'une même session sont regroupés en un seul
+      add_messages ; une session n'a jamais plus d'une écriture en cours,
+      ce qui garantit l'ordre des messages par session
+    - échec transitoire (429, 5xx, réseau, gouverneur saturé) : nouvelles
+      tentatives avec backoff exponentiel + jitter ; le lot reste en tête de
+      sa session, les messages arrivés entre-temps suivent. Erreur permanente
+      (4xx, validation) : le lot est abandonné sans attendre
+    - drain() (arrêt de l'app) attend que tout soit écrit, dans un délai borné
+
+    Utilisation :
+        queue = MemoryWriteQueue(workers=4)
+        queue.start()                          # dans la boucle asyncio
+        queue.enqueue(mem, [{"role": "user", "content": "..."}, ...])
+        await queue.drain()
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_batch: int = 50,
+        max_retries: int = 5,
+        base_delay_s: float = 0.5,
+    ):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        # session → (mémoire, [(horodatage d'arrivée, message)])
+        self._pending: Dict[str, Tuple[AsyncZepMemory, Deque[Tuple[float, dict]]]] = {}
+        self._inflight: Set[str] = set()
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.last_lag_s = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"zep-writer-{i}")
+                for i in range(self.workers)
+            ]
+
+    def enqueue(self, mem: AsyncZepMemory, messages: List[dict]):
+        if not messages:
+            return
+        now = time.monotonic()
+        entry = self._pending.get(mem.session_id)
+        if entry is None:
+            entry = self._pending[mem.session_id] = (mem, deque())
+        entry[1].extend((now, m) for m in messages)
+        self._idle.clear()
+        if mem.session_id not in self._inflight:
+            self._ready.put_nowait(mem.session_id)
+
+    def _take(self, session_id: str) -> Tuple[Optional[AsyncZepMemory], List]:
+        entry = self._pending.get(session_id)
+        if entry is None or not entry[1]:
+            return None, []
+        mem, queued = entry
+        batch = [queued.popleft() for _ in range(min(self.max_batch, len(queued)))]
+        return mem, batch
+
+    async def _write(self, mem: AsyncZepMemory, batch: List[Tuple[float, dict]]):
+        messages = [m for _, m in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Un essai par tour : les retries (plus longs) sont gérés ici
+                await mem.add_messages(messages, max_retries=0)
+                self.written += len(messages)
+                self.batches += 1
+                self.last_lag_s = time.monotonic() - batch[0][0]
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Rejet du gouverneur : service saturé, l'écriture peut attendre
+                transient = is_retryable(e) or isinstance(e, Overloaded)
+                if not transient or attempt == self.max_retries:
+                    self.failed += len(messages)
+                    log.error(
+                        "Écriture Zep abandonnée (%s, %d messages, %s): %s",
+                        mem.session_id,
+                        len(messages),
+                        "essais épuisés" if transient else "erreur permanente",
+                        e,
+                    )
+                    return
+                self.retries += 1
+                hint = e.retry_after_s if isinstance(e, Overloaded) else retry_after(e)
+                await asyncio.sleep(
+                    backoff_delay(
+                        attempt, base_s=self.base_delay_s, max_s=60.0, hint_s=hint
+                    )
+                )
+
+    async def _worker(self):
+        while True:
+            session_id = await self._ready.get()
+            try:
+                if session_id in self._inflight:
+                    continue
+                mem, batch = self._take(session_id)
+                if not batch:
+                    continue
+                self._inflight.add(session_id)
+                try:
+                    await self._write(mem, batch)
+                finally:
+                    self._inflight.discard(session_id)
+                # Messages arrivés pendant l'écriture : la session repasse en file
+                if self._pending[session_id][1]:
+                    self._ready.put_nowait(session_id)
+                else:
+                    del self._pending[session_id]
+            finally:
+                self._ready.task_done()
+                if not self._pending and not self._inflight:
+                    self._idle.set()
+
+    async def drain(self, timeout_s: Optional[float] = None):
+        """Attend l'écriture de tout ce qui est en file, puis arrête les workers."""
+        timeout_s = (
+            settings.memory_queue_drain_timeout_s if timeout_s is None else timeout_s
+        )
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout_s)
+        except asyncio.TimeoutError:
+            log.error(
+                "Arrêt : %d messages Zep non écrits après %.0fs",
+                self.depth(),
+                timeout_s,
+            )
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self) -> int:
+        return sum(len(q) for _, q in self._pending.values())
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        oldest = min((q[0][0] for _, q in self._pending.values() if q), default=None)
+        return {
+            "depth": self.depth(),
+            "sessions": len(self._pending),
+            "inflight": len(self._inflight),
+            # Âge du plus vieux message pas encore écrit
+            "lag_s": round(now - oldest, 3) if oldest is not None else 0.0,
+            "last_write_lag_s": round(self.last_lag_s, 3),
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+
+_queue: Optional[MemoryWriteQueue] = None
+
+
+def get_memory_queue() -> Optional[MemoryWriteQueue]:
+    """File partagée du process ; None si MEMORY_WRITE_BEHIND est désactivé."""
+    global _queue
+    if not settings.memory_write_behind:
+        return None
+    if _queue is None:
+        _queue = MemoryWriteQueue(
+            workers=settings.memory_queue_workers,
+            max_retries=settings.memory_queue_max_retries,
+        )
+    return _queue
@@ -0,0 +1,236 @@
+"""
+Instrumentation du chemin des requêtes : spans, métriques Prometheus, log
+des requêtes lentes.
+
+Un span mesure une étape (nœud du graphe, appel amont, écriture checkpoint) :
+sa durée alimente l'histogramme rag_span_seconds{kind, name}, une exception
+incrémente rag_errors_total, et le span est ajouté à la trace de la requête
+en cours (contextvar, même portée que le request_id de logging_filters).
+
+    with span("upstream", "qdrant.search"):
+        ...
+
+Le middleware HTTP ouvre la trace et la termine ; au-delà de SLOW_REQUEST_MS,
+la trace complète (spans et durées) est loggée. Les flux SSE terminent leur
+trace à la fin du flux (defer_trace).
+
+Les compteurs déjà exposés dans /health (caches, files, pools) sont publiés
+tels quels via register_stats(), lus au moment du scrape.
+"""
+
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from logging_filters import get_request_id
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds",
+    "Durée des requêtes HTTP (flux SSE : jusqu'à la fin du flux)",
+    ["route", "status"],
+    buckets=_BUCKETS,
+)
+SPAN_SECONDS = Histogram(
+    "rag_span_seconds",
+    "Durée des étapes d'une requête (nœuds du graphe, appels amont, checkpoints)",
+    ["kind", "name"],
+    buckets=_BUCKETS,
+)
+ERRORS = Counter(
+    "rag_errors_total",
+    "Étapes terminées en erreur",
+    ["kind", "name", "error"],
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Tokens facturés par OpenAI (usage des réponses)",
+    ["model", "type"],
+)
+UPSTREAM_WAIT_SECONDS = Histogram(
+    "rag_upstream_wait_seconds",
+    "Attente d'un slot du gouverneur avant un appel amont",
+    ["upstream"],
+    buckets=_BUCKETS,
+)
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    start_ms: float  # depuis le début de la trace
+    duration_ms: float
+    error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+    request_id: str
+    route: str
+    started: float = field(default_factory=time.perf_counter)
+    spans: List[Span] = field(default_factory=list)
+    # Terminée par le producteur du flux, pas par le middleware
+    deferred: bool = False
+    finished: bool = False
+
+
+_trace_ctx: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "trace", default=None
+)
+
+
+def start_trace(route: str) -> Trace:
+    trace = Trace(get_request_id(), route)
+    _trace_ctx.set(trace)
+    return trace
+
+
+def defer_trace() -> Optional[Trace]:
+    """La trace courante sera terminée par l'appelant (fin d'un flux SSE)."""
+    trace = _trace_ctx.get()
+    if trace is not None:
+        trace.deferred = True
+    return trace
+
+
+def finish_trace(trace: Optional[Trace], status: int):
+    if trace is None or trace.finished:
+        return
+    trace.finished = True
+    elapsed = time.perf_counter() - trace.started
+    REQUEST_SECONDS.labels(trace.route, str(status)).observe(elapsed)
+    slow_ms = settings.slow_request_ms
+    if slow_ms > 0 and elapsed * 1000 >= slow_ms:
+        log.warning(
+            "Requête lente %s (%s) : %.0f ms | %s",
+            trace.route,
+            status,
+            elapsed * 1000,
+            format_spans(trace.spans),
+        )
+
+
+def format_spans(spans: List[Span]) -> str:
+    return " ; ".join(
+        f"{s.kind}:{s.name} +{s.start_ms:.0f} {s.duration_ms:.0f}ms"
+        + (f" [{s.error}]" if s.error else "")
+        for s in sorted(spans, key=lambda s: s.start_ms)
+    )
+
+
+@contextmanager
+def span(kind: str, name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    error: Optional[str] = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.labels(kind, name).observe(elapsed)
+        if error is not None:
+            ERRORS.labels(kind, name, error).inc()
+        trace = _trace_ctx.get()
+        if trace is not None:
+            trace.spans.append(
+                Span(
+                    kind,
+                    name,
+                    (started - trace.started) * 1000,
+                    elapsed * 1000,
+                    error,
+                )
+            )
+
+
+def traced_node(name: str, fn: Callable) -> Callable:
+    """Nœud async du graphe mesuré par un span "node"."""
+
+    async def node(state: Any) -> Any:
+        with span("node", name):
+            return await fn(state)
+
+    node.__name__ = getattr(fn, "__name__", name)
+    return node
+
+
+def record_tokens(model: str, usage: Any):
+    """Compte l'usage d'une réponse OpenAI (chat ou embeddings), s'il est fourni."""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    if prompt:
+        LLM_TOKENS.labels(model, "prompt").inc(prompt)
+    if completion:
+        LLM_TOKENS.labels(model, "completion").inc(completion)
+
+
+# === Statistiques existantes (stats()) publiées comme jauges
+
+
+class _StatsCollector:
+    def __init__(self):
+        self._sources: List[Tuple[str, Callable[[], Any], Optional[str]]] = []
+
+    def register(self, name: str, fn: Callable[[], Any], label: Optional[str]):
+        self._sources.append((name, fn, label))
+
+    def collect(self):
+        for name, fn, label in self._sources:
+            try:
+                data = fn()
+            except Exception as e:
+                log.warning("Statistiques %s indisponibles: %s", name, e)
+                continue
+            if not data:
+                continue
+            families: Dict[str, GaugeMetricFamily] = {}
+            groups = data.items() if label else [(None, data)]
+            for group, values in groups:
+                for key, value in (values or {}).items():
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    metric = f"rag_{name}_{key}"
+                    family = families.get(metric)
+                    if family is None:
+                        family = families[metric] = GaugeMetricFamily(
+                            metric, f"{name}: {key}", labels=[label] if label else []
+                        )
+                    family.add_metric([str(group)] if label else [], value)
+            yield from families.values()
+
+
+_stats = _StatsCollector()
+REGISTRY.register(_stats)
+
+
+def register_stats(name: str, fn: Callable[[], Any], label: Optional[str] = None):
+    """
+    Publie fn() ({clé: nombre}) en jauges rag_<name>_<clé>. Avec label, fn()
+    retourne {groupe: {clé: nombre}} et le groupe devient ce label.
+    """
+    _stats.register(name, fn, label)
+
+
+def render() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,25 +1,334 @@
-from typing import List, Tuple, Optional
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue
-from openai import OpenAI
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple, Optional
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.models import (
+    Filter,
+    FieldCondition,
+    MatchValue,
+    QuantizationSearchParams,
+    ScoredPoint,
+    SearchParams,
+    SearchRequest,
+)
+from openai import AsyncOpenAI, OpenAI
+from embed_cache import QueryEmbeddingCache, cache_key, get_query_cache
+from governor import acall, retry
+from metrics import record_tokens
 from settings import settings
 
-# Modèle d'embeddings OpenAI (1536 dims)
+# Modèle d'embeddings OpenAI (1536 dims natifs, réductibles via EMBED_DIMENSIONS)
 EMBED_MODEL = "text-embedding-3-small"
 
-# Client OpenAI pour les embeddings
-_client_openai = OpenAI(api_key=settings.openai_api_key)
 
+def embed_dim() -> int:
+    return settings.embed_dimensions or 1536
+
+
+def _embed_key() -> str:
+    # Clé des caches : deux dimensions différentes sont deux espaces distincts
+    return f"{EMBED_MODEL}@{embed_dim()}"
+
+
+# Clients OpenAI pour les embeddings (sync : ingestion/CLI, async : requêtes),
+# créés au premier appel : l'import du module ne construit rien
+_client_openai: Optional[OpenAI] = None
+_client_openai_async: Optional[AsyncOpenAI] = None
+
+
+def _openai() -> OpenAI:
+    global _client_openai
+    if _client_openai is None:
+        # max_retries=0 : le gouverneur et EmbedScheduler sont la seule couche
+        # de retry (pas de 429 absorbé en silence, slots non gardés pendant
+        # les attentes du SDK)
+        _client_openai = OpenAI(api_key=settings.openai_api_key, max_retries=0)
+    return _client_openai
+
+
+def _aopenai() -> AsyncOpenAI:
+    global _client_openai_async
+    if _client_openai_async is None:
+        _client_openai_async = AsyncOpenAI(
+            api_key=settings.openai_api_key, max_retries=0
+        )
+    return _client_openai_async
+
+
+def collection_for(project: Optional[str]) -> str:
+    """
+    Collection Qdrant d'un projet selon QDRANT_TENANCY :
+    - shared      : une collection commune, filtrée par payload.project (indexé)
+    - per_project : une collection par projet, <collection>__<projet>
+    """
+    if settings.qdrant_tenancy != "per_project":
+        return settings.qdrant_collection
+    slug = "".join(c if c.isalnum() or c in "-_" else "_" for c in project or "default")
+    return f"{settings.qdrant_collection}__{slug}"
+
+
+def _embed_kwargs() -> Dict[str, int]:
+    return {"dimensions": embed_dim()} if settings.embed_dimensions else {}
+
+
+def _cache_lookup(
+    qcache: QueryEmbeddingCache, texts: List[str]
+) -> Tuple[List[str], Dict[str, List[float]], List[str], List[str]]:
+    """Retourne (clés, vecteurs trouvés, clés manquantes, textes manquants)."""
+    embed_key = _embed_key()
+    keys = [cache_key(embed_key, t) for t in texts]
+    found: Dict[str, List[float]] = {}
+    for k in keys:
+        if k not in found:
+            vec = qcache.get(k)
+            if vec is not None:
+                found[k] = vec
+    missing = list(dict.fromkeys(k for k in keys if k not in found))
+    by_key = dict(zip(keys, texts))
+    return keys, found, missing, [by_key[k] for k in missing]
+
+
+def _cache_store(
+    qcache: QueryEmbeddingCache, keys: List[str], vectors: List[List[float]]
+):
+    for k, vec in zip(keys, vectors):
+        qcache.put(k, vec)
 
-def embed(texts: List[str]) -> List[List[float]]:
+
+def _create(texts: List[str], max_retries: Optional[int]):
+    res = retry(
+        "openai_embed",
+        lambda: _openai().embeddings.create(
+            model=EMBED_MODEL, input=texts, **_embed_kwargs()
+        ),
+        max_retries,
+        op="embeddings",
+    )
+    record_tokens(EMBED_MODEL, getattr(res, "usage", None))
+    return res
+
+
+async def _acreate(texts: List[str]):
+    # Appel limité par le gouverneur (concurrence, débit) et rejoué si transitoire
+    res = await acall(
+        "openai_embed",
+        lambda: _aopenai().embeddings.create(
+            model=EMBED_MODEL, input=texts, **_embed_kwargs()
+        ),
+        op="embeddings",
+    )
+    record_tokens(EMBED_MODEL, getattr(res, "usage", None))
+    return res
+
+
+def embed(
+    texts: List[str], cache: bool = False, max_retries: Optional[int] = None
+) -> List[List[float]]:
     """
     Calcule les embeddings OpenAI pour une liste de textes.
-    Retourne une liste de vecteurs (List[float]) de taille 1536.
+    Retourne une liste de vecteurs (List[float]) de taille embed_dim().
+    - cache : passe par le cache des requêtes (LRU + sqlite optionnel) ;
+      réservé aux requêtes utilisateur, pas aux chunks d'ingestion.
+      Les textes absents du cache partent en un seul appel.
+    - max_retries : essais sur erreur transitoire (None = UPSTREAM_MAX_RETRIES,
+      0 = aucun, pour un appelant qui gère ses propres retries)
     """
     if not texts:
         return []
-    res = _client_openai.embeddings.create(model=EMBED_MODEL, input=texts)
-    return [d.embedding for d in res.data]
+    qcache = get_query_cache() if cache else None
+    if qcache is None:
+        res = _create(texts, max_retries)
+        return [d.embedding for d in res.data]
+
+    keys, found, missing, missing_texts = _cache_lookup(qcache, texts)
+    if missing:
+        res = _create(missing_texts, max_retries)
+        for k, d in zip(missing, res.data):
+            qcache.put(k, d.embedding)
+            found[k] = d.embedding
+    return [found[k] for k in keys]
+
+
+async def aembed(texts: List[str], cache: bool = False) -> List[List[float]]:
+    """Variante asynchrone de embed() (AsyncOpenAI), même cache."""
+    if not texts:
+        return []
+    qcache = get_query_cache() if cache else None
+    if qcache is None:
+        res = await _acreate(texts)
+        return [d.embedding for d in res.data]
+
+    # Niveau sqlite : lectures et écritures hors de la boucle d'événements
+    if qcache.has_disk:
+        lookup = await asyncio.to_thread(_cache_lookup, qcache, texts)
+    else:
+        lookup = _cache_lookup(qcache, texts)
+    keys, found, missing, missing_texts = lookup
+    if missing:
+        res = await _acreate(missing_texts)
+        vectors = [d.embedding for d in res.data]
+        found.update(zip(missing, vectors))
+        if qcache.has_disk:
+            await asyncio.to_thread(_cache_store, qcache, missing, vectors)
+        else:
+            _cache_store(qcache, missing, vectors)
+    return [found[k] for k in keys]
+
+
+def search_params(
+    hnsw_ef: Optional[int] = None,
+    oversampling: Optional[float] = None,
+    rescore: Optional[bool] = None,
+) -> Optional[SearchParams]:
+    """
+    Paramètres de recherche Qdrant ; None → valeurs de settings.
+    - hnsw_ef : largeur d'exploration HNSW (0 = défaut Qdrant)
+    - oversampling / rescore : utilisés si la collection est quantifiée
+      (candidats sur vecteurs quantifiés, puis rescoring sur les originaux)
+    """
+    hnsw_ef = settings.qdrant_hnsw_ef if hnsw_ef is None else hnsw_ef
+    oversampling = (
+        settings.qdrant_oversampling if oversampling is None else oversampling
+    )
+    rescore = settings.qdrant_rescore if rescore is None else rescore
+    quantization = None
+    if settings.qdrant_quantization != "none":
+        quantization = QuantizationSearchParams(
+            rescore=rescore, oversampling=oversampling or None
+        )
+    if not hnsw_ef and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=hnsw_ef or None, quantization=quantization)
+
+
+def _project_filter(project: Optional[str]) -> Optional[Filter]:
+    if not project:
+        return None
+    return Filter(must=[FieldCondition(key="project", match=MatchValue(value=project))])
+
+
+def _format_hit(h: ScoredPoint) -> str:
+    payload = h.payload or {}
+    txt = (payload.get("text") or "").strip()
+    src = payload.get("source") or ""
+    # [source] texte, précisé par la définition Python ou la section Markdown
+    if src and payload.get("symbol"):
+        src = f"{src}:{payload['symbol']}"
+    elif src and payload.get("section"):
+        src = f"{src} § {payload['section']}"
+    return f"[{src}] {txt}" if src else txt
+
+
+@dataclass(frozen=True)
+class DocHit:
+    id: str  # ID du point Qdrant (uuid5 projet/source/chunk)
+    text: str  # texte formaté "[source] chunk"
+    score: float
+    vector: Optional[List[float]] = None  # si with_vectors=True
+
+
+def mmr_select(
+    query_vectors: Sequence[Sequence[float]],
+    doc_vectors: Sequence[Sequence[float]],
+    top_k: int,
+    lambda_: float = 0.5,
+) -> List[int]:
+    """
+    Maximal Marginal Relevance : choisit top_k documents en arbitrant entre
+    pertinence (cosinus max avec les requêtes) et redondance (cosinus max avec
+    les documents déjà choisis). lambda_=1 : pertinence seule.
+    Retourne les indices choisis, dans l'ordre de sélection.
+    """
+    if not len(doc_vectors):
+        return []
+    docs = np.asarray(doc_vectors, dtype=np.float32)
+    docs /= np.maximum(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12)
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    relevance = (docs @ queries.T).max(axis=1)
+    similarity = docs @ docs.T
+    selected: List[int] = []
+    redundancy = np.full(len(docs), -np.inf, dtype=np.float32)
+    available = np.ones(len(docs), dtype=bool)
+    while len(selected) < min(top_k, len(docs)):
+        if selected:
+            scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def _diversify(
+    hits: List[DocHit],
+    query_vectors: List[List[float]],
+    top_k: int,
+    mmr_lambda: Optional[float],
+    with_vectors: bool,
+) -> List[DocHit]:
+    if mmr_lambda is not None:
+        order = mmr_select(query_vectors, [h.vector for h in hits], top_k, mmr_lambda)
+        hits = [hits[i] for i in order]
+    if not with_vectors:
+        hits = [DocHit(h.id, h.text, h.score) for h in hits]
+    return hits[:top_k]
+
+
+def _batch_requests(
+    vectors: List[List[float]],
+    project: Optional[str],
+    top_k: int,
+    params: Optional[SearchParams],
+    with_vectors: bool = False,
+) -> List[SearchRequest]:
+    q_filter = _project_filter(project)
+    return [
+        SearchRequest(
+            vector=v,
+            filter=q_filter,
+            params=params,
+            limit=top_k,
+            with_payload=True,
+            with_vector=with_vectors,
+        )
+        for v in vectors
+    ]
+
+
+def _fetch_k(top_k: int, mmr_lambda: Optional[float]) -> int:
+    # MMR choisit parmi un vivier plus large que top_k
+    if mmr_lambda is None:
+        return top_k
+    return max(top_k, top_k * settings.retrieval_mmr_fetch_factor)
+
+
+def _hit(h: ScoredPoint, score: float) -> DocHit:
+    vector = h.vector if isinstance(h.vector, list) else None
+    return DocHit(str(h.id), _format_hit(h), score, vector)
+
+
+def rrf_fuse(
+    rankings: Sequence[Sequence[ScoredPoint]], top_k: int, k: int = 60
+) -> List[Tuple[ScoredPoint, float]]:
+    """
+    Reciprocal Rank Fusion : score(p) = Σ 1 / (k + rang de p dans chaque liste).
+    Les points sont dédupliqués par ID ; retourne les top_k (point, score fusionné).
+    """
+    scores: Dict[str, float] = {}
+    points: Dict[str, ScoredPoint] = {}
+    for ranking in rankings:
+        for rank, h in enumerate(ranking, start=1):
+            pid = str(h.id)
+            scores[pid] = scores.get(pid, 0.0) + 1.0 / (k + rank)
+            points.setdefault(pid, h)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+    return [(points[pid], scores[pid]) for pid in best]
 
 
 class DocsRetriever:
@@ -36,11 +345,43 @@ class DocsRetriever:
         r = DocsRetriever()
         results = r.search("ma question", top_k=5, project="SAP")
         # results -> List[(formatted_text, score)]
+        fused = r.search_batch(["question", "reformulation"], top_k=5, project="SAP")
+        hits = r.search_hits(["question"], top_k=5, project="SAP")
+        # hits -> List[DocHit] (ID du point, texte formaté, score)
+        # variantes async (AsyncQdrantClient + AsyncOpenAI) : asearch, asearch_batch,
+        # asearch_hits
     """
 
     def __init__(self, collection: Optional[str] = None):
-        self.collection = collection or settings.qdrant_collection
-        self.client = QdrantClient(url=settings.qdrant_url)
+        # None : collection résolue par projet (cf. collection_for)
+        self.collection = collection
+        self._client: Optional[QdrantClient] = None
+        self._aclient: Optional[AsyncQdrantClient] = None
+
+    # Clients Qdrant créés au premier usage (sync : CLI/bench, async : requêtes)
+    @property
+    def client(self) -> QdrantClient:
+        if self._client is None:
+            self._client = QdrantClient(url=settings.qdrant_url)
+        return self._client
+
+    @client.setter
+    def client(self, value: QdrantClient):
+        self._client = value
+
+    @property
+    def aclient(self) -> AsyncQdrantClient:
+        if self._aclient is None:
+            self._aclient = AsyncQdrantClient(url=settings.qdrant_url)
+        return self._aclient
+
+    @aclient.setter
+    def aclient(self, value: AsyncQdrantClient):
+        self._aclient = value
+
+    async def awarmup(self):
+        """Ouvre la connexion HTTP du client async (liste des collections)."""
+        await self.aclient.get_collections()
 
     def search(
         self,
@@ -48,6 +389,9 @@ class DocsRetriever:
         top_k: int = 5,
         project: Optional[str] = None,
         with_scores: bool = True,
+        hnsw_ef: Optional[int] = None,
+        oversampling: Optional[float] = None,
+        rescore: Optional[bool] = None,
     ) -> List[Tuple[str, float]]:
         """
         Recherche sémantique dans la collection Qdrant.
@@ -55,35 +399,189 @@ class DocsRetriever:
         - top_k : nb de résultats à retourner
         - project : filtre strict sur le projet (payload.project == project)
         - with_scores : retourne le score de similarité de Qdrant
+        - hnsw_ef / oversampling / rescore : cf. search_params()
 
         Retour : liste de tuples (texte_formatté, score)
         """
         if not query.strip():
             return []
 
-        q_emb = embed([query])[0]
-
-        q_filter = None
-        if project:
-            q_filter = Filter(must=[FieldCondition(key="project", match=MatchValue(value=project))])
+        q_emb = embed([query], cache=True)[0]
 
         hits = self.client.search(
-            collection_name=self.collection,
+            collection_name=self.collection or collection_for(project),
             query_vector=q_emb,
             limit=top_k,
-            query_filter=q_filter,
+            query_filter=_project_filter(project),
+            search_params=search_params(hnsw_ef, oversampling, rescore),
             with_payload=True,
             with_vectors=False,
         )
+        return [(_format_hit(h), float(h.score) if with_scores else 0.0) for h in hits]
+
+    def search_hits(
+        self,
+        queries: Sequence[str],
+        top_k: int = 5,
+        project: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+        oversampling: Optional[float] = None,
+        rescore: Optional[bool] = None,
+        rrf_k: int = 60,
+        mmr_lambda: Optional[float] = None,
+        with_vectors: bool = False,
+    ) -> List[DocHit]:
+        """
+        Recherche multi-requêtes en deux allers-retours au total :
+        un appel embeddings pour toutes les requêtes (cache compris) et un
+        appel search_batch Qdrant. Les listes sont fusionnées par RRF et
+        dédupliquées par ID de point.
+        Avec une seule requête (après dédoublonnage), pas de fusion : le score
+        retourné est le score de similarité, comme pour search().
+        - mmr_lambda : diversification MMR parmi top_k * RETRIEVAL_MMR_FETCH_FACTOR
+          candidats (None = classement par pertinence seule)
+        - with_vectors : renseigne DocHit.vector
+
+        Retour : liste de DocHit (ID du point, texte formaté, score[, vecteur])
+        """
+        queries = list(dict.fromkeys(q for q in queries if q.strip()))
+        if not queries:
+            return []
+        params = search_params(hnsw_ef, oversampling, rescore)
+        collection = self.collection or collection_for(project)
+        vectors = embed(queries, cache=True)
+        fetch_k = _fetch_k(top_k, mmr_lambda)
+        need_vectors = with_vectors or mmr_lambda is not None
+        if len(queries) == 1:
+            points = self.client.search(
+                collection_name=collection,
+                query_vector=vectors[0],
+                limit=fetch_k,
+                query_filter=_project_filter(project),
+                search_params=params,
+                with_payload=True,
+                with_vectors=need_vectors,
+            )
+            hits = [_hit(h, float(h.score)) for h in points]
+        else:
+            rankings = self.client.search_batch(
+                collection_name=collection,
+                requests=_batch_requests(
+                    vectors, project, fetch_k, params, need_vectors
+                ),
+            )
+            hits = [_hit(h, score) for h, score in rrf_fuse(rankings, fetch_k, rrf_k)]
+        return _diversify(hits, vectors, top_k, mmr_lambda, with_vectors)
+
+    def search_batch(
+        self,
+        queries: Sequence[str],
+        top_k: int = 5,
+        project: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+        oversampling: Optional[float] = None,
+        rescore: Optional[bool] = None,
+        rrf_k: int = 60,
+    ) -> List[Tuple[str, float]]:
+        """Comme search_hits() ; retour : liste de tuples (texte_formatté, score)."""
+        hits = self.search_hits(
+            queries, top_k, project, hnsw_ef, oversampling, rescore, rrf_k
+        )
+        return [(h.text, h.score) for h in hits]
+
+    async def asearch(
+        self,
+        query: str,
+        top_k: int = 5,
+        project: Optional[str] = None,
+        with_scores: bool = True,
+        hnsw_ef: Optional[int] = None,
+        oversampling: Optional[float] = None,
+        rescore: Optional[bool] = None,
+    ) -> List[Tuple[str, float]]:
+        """Variante asynchrone de search()."""
+        if not query.strip():
+            return []
+
+        q_emb = (await aembed([query], cache=True))[0]
+
+        hits = await acall(
+            "qdrant",
+            lambda: self.aclient.search(
+                collection_name=self.collection or collection_for(project),
+                query_vector=q_emb,
+                limit=top_k,
+                query_filter=_project_filter(project),
+                search_params=search_params(hnsw_ef, oversampling, rescore),
+                with_payload=True,
+                with_vectors=False,
+            ),
+            op="search",
+        )
+        return [(_format_hit(h), float(h.score) if with_scores else 0.0) for h in hits]
 
-        results: List[Tuple[str, float]] = []
-        for h in hits:
-            payload = h.payload or {}
-            txt = (payload.get("text") or "").strip()
-            src = payload.get("source") or ""
-            # Format simple : [source] texte
-            formatted = f"[{src}] {txt}" if src else txt
-            score = float(h.score) if with_scores else 0.0
-            results.append((formatted, score))
-
-        return results
+    async def asearch_hits(
+        self,
+        queries: Sequence[str],
+        top_k: int = 5,
+        project: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+        oversampling: Optional[float] = None,
+        rescore: Optional[bool] = None,
+        rrf_k: int = 60,
+        mmr_lambda: Optional[float] = None,
+        with_vectors: bool = False,
+    ) -> List[DocHit]:
+        """Variante asynchrone de search_hits()."""
+        queries = list(dict.fromkeys(q for q in queries if q.strip()))
+        if not queries:
+            return []
+        params = search_params(hnsw_ef, oversampling, rescore)
+        collection = self.collection or collection_for(project)
+        vectors = await aembed(queries, cache=True)
+        fetch_k = _fetch_k(top_k, mmr_lambda)
+        need_vectors = with_vectors or mmr_lambda is not None
+        if len(queries) == 1:
+            points = await acall(
+                "qdrant",
+                lambda: self.aclient.search(
+                    collection_name=collection,
+                    query_vector=vectors[0],
+                    limit=fetch_k,
+                    query_filter=_project_filter(project),
+                    search_params=params,
+                    with_payload=True,
+                    with_vectors=need_vectors,
+                ),
+                op="search",
+            )
+            hits = [_hit(h, float(h.score)) for h in points]
+        else:
+            rankings = await acall(
+                "qdrant",
+                lambda: self.aclient.search_batch(
+                    collection_name=collection,
+                    requests=_batch_requests(
+                        vectors, project, fetch_k, params, need_vectors
+                    ),
+                ),
+                op="search_batch",
+            )
+            hits = [_hit(h, score) for h, score in rrf_fuse(rankings, fetch_k, rrf_k)]
+        return _diversify(hits, vectors, top_k, mmr_lambda, with_vectors)
+
+    async def asearch_batch(
+        self,
+        queries: Sequence[str],
+        top_k: int = 5,
+        project: Optional[str] = None,
+        hnsw_ef: Optional[int] = None,
+        oversampling: Optional[float] = None,
+        rescore: Optional[bool] = None,
+        rrf_k: int = 60,
+    ) -> List[Tuple[str, float]]:
+        """Variante asynchrone de search_batch()."""
+        hits = await self.asearch_hits(
+            queries, top_k, project, hnsw_ef, oversampling, rescore, rrf_k
+        )
+        return [(h.text, h.score) for h in hits]
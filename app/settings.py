@@ -1,9 +1,17 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
 class Settings(BaseSettings):
     # LLM
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
+    chat_model: str = Field("gpt-4o-mini", env="CHAT_MODEL")
+    # Budget de tokens du contexte injecté dans le prompt (0 = illimité)
+    context_token_budget: int = Field(1500, env="CONTEXT_TOKEN_BUDGET")
+    # Part des n-grammes d'une ligne déjà présents ailleurs au-delà de laquelle
+    # elle est considérée comme un doublon
+    context_dedup_threshold: float = Field(0.8, env="CONTEXT_DEDUP_THRESHOLD")
 
     # App
     app_port: int = Field(5173, env="APP_PORT")
@@ -12,12 +20,154 @@ class Settings(BaseSettings):
     # Zep
     zep_api_url: str = Field("http://zep:8000", env="ZEP_API_URL")
     zep_api_key: str = Field("dev", env="ZEP_API_KEY")
+    # Client HTTP partagé (keep-alive) et registre des sessions déjà créées
+    zep_max_connections: int = Field(20, env="ZEP_MAX_CONNECTIONS")
+    zep_max_keepalive: int = Field(10, env="ZEP_MAX_KEEPALIVE")
+    zep_timeout_s: float = Field(10.0, env="ZEP_TIMEOUT_S")
+    zep_known_users_max: int = Field(10_000, env="ZEP_KNOWN_USERS_MAX")
+    # Écriture différée des tours dans Zep (hors du chemin critique de la réponse)
+    memory_write_behind: bool = Field(True, env="MEMORY_WRITE_BEHIND")
+    memory_queue_workers: int = Field(4, env="MEMORY_QUEUE_WORKERS")
+    memory_queue_max_retries: int = Field(5, env="MEMORY_QUEUE_MAX_RETRIES")
+    memory_queue_drain_timeout_s: float = Field(30.0, env="MEMORY_QUEUE_DRAIN_TIMEOUT_S")
+    # Buffer local des derniers messages par session (0 session = désactivé)
+    turn_buffer_sessions: int = Field(1000, env="TURN_BUFFER_SESSIONS")
+    turn_buffer_messages: int = Field(20, env="TURN_BUFFER_MESSAGES")
+    turn_buffer_max_bytes: int = Field(8 * 1024 * 1024, env="TURN_BUFFER_MAX_BYTES")
+    # Historique plus ancien que les derniers tours : recherche Zep (0 = désactivée)
+    zep_search_limit: int = Field(3, env="ZEP_SEARCH_LIMIT")
+
+    # Embeddings : 0 = dimension native du modèle (1536)
+    embed_dimensions: int = Field(0, env="EMBED_DIMENSIONS")
 
     # Qdrant
     qdrant_url: str = Field("http://qdrant:6333", env="QDRANT_URL")
     qdrant_collection: str = Field("project_docs", env="QDRANT_COLLECTION")
+    # "shared" (une collection, filtre project indexé) ou "per_project"
+    qdrant_tenancy: str = Field("shared", env="QDRANT_TENANCY")
+    # En mode shared : HNSW par projet (payload_m) plutôt que graphe global
+    qdrant_tenant_hnsw: bool = Field(False, env="QDRANT_TENANT_HNSW")
+    # Stockage : "none" | "scalar" (int8) | "binary" ; vecteurs originaux sur disque
+    qdrant_quantization: str = Field("none", env="QDRANT_QUANTIZATION")
+    qdrant_on_disk: bool = Field(False, env="QDRANT_ON_DISK")
+    # Recherche (0 = défaut Qdrant)
+    qdrant_hnsw_ef: int = Field(0, env="QDRANT_HNSW_EF")
+    qdrant_oversampling: float = Field(2.0, env="QDRANT_OVERSAMPLING")
+    qdrant_rescore: bool = Field(True, env="QDRANT_RESCORE")
+    # Diversification MMR des passages (1 = pertinence seule, MMR désactivé)
+    retrieval_mmr_lambda: float = Field(0.7, env="RETRIEVAL_MMR_LAMBDA")
+    retrieval_mmr_fetch_factor: int = Field(3, env="RETRIEVAL_MMR_FETCH_FACTOR")
+    # Passages injectés par question (chunks plus petits et plus ciblés)
+    retrieval_top_k: int = Field(3, env="RETRIEVAL_TOP_K")
+
+    # Ingestion (manifests incrémentaux par projet)
+    ingest_state_dir: str = Field("/data/ingest", env="INGEST_STATE_DIR")
+    ingest_embed_batch_size: int = Field(64, env="INGEST_EMBED_BATCH_SIZE")
+    ingest_upsert_batch_size: int = Field(256, env="INGEST_UPSERT_BATCH_SIZE")
+    ingest_embed_workers: int = Field(4, env="INGEST_EMBED_WORKERS")
+    ingest_embed_tpm: int = Field(1_000_000, env="INGEST_EMBED_TPM")  # 0 = illimité
+    ingest_embed_max_retries: int = Field(6, env="INGEST_EMBED_MAX_RETRIES")
+    # Découpage : taille et recouvrement en tokens du modèle d'embeddings
+    chunk_max_tokens: int = Field(300, env="CHUNK_MAX_TOKENS")
+    chunk_overlap_tokens: int = Field(40, env="CHUNK_OVERLAP_TOKENS")
+    chunk_token_model: str = Field("text-embedding-3-small", env="CHUNK_TOKEN_MODEL")
+    # Store local d'embeddings (vide = désactivé)
+    embed_store_dir: str = Field("/data/embeddings", env="EMBED_STORE_DIR")
+
+    # Cache des embeddings de requêtes (0 = désactivé ; chemin vide = pas de niveau disque)
+    query_cache_size: int = Field(1024, env="QUERY_CACHE_SIZE")
+    query_cache_path: str = Field("", env="QUERY_CACHE_PATH")
+    query_cache_disk_max_entries: int = Field(100_000, env="QUERY_CACHE_DISK_MAX_ENTRIES")
+    query_cache_ttl_s: int = Field(0, env="QUERY_CACHE_TTL_S")
+
+    # Cache sémantique des réponses (0 = désactivé)
+    answer_cache_size: int = Field(2048, env="ANSWER_CACHE_SIZE")
+    answer_cache_ttl_s: int = Field(86400, env="ANSWER_CACHE_TTL_S")  # 0 = jamais
+    # Cosinus minimal entre questions pour réutiliser une réponse
+    answer_cache_threshold: float = Field(0.95, env="ANSWER_CACHE_THRESHOLD")
+
+    # Regroupement des requêtes identiques en cours (retrieval et reason)
+    singleflight_enabled: bool = Field(True, env="SINGLEFLIGHT_ENABLED")
+
+    # /chat : nb max de messages gardés dans l'historique du thread (0 = illimité)
+    chat_history_window: int = Field(20, env="CHAT_HISTORY_WINDOW")
+
+    # Pièces jointes (images) adressées par contenu
+    attachments_dir: str = Field("/data/attachments", env="ATTACHMENTS_DIR")
+    attachments_max_bytes: int = Field(10 * 1024 * 1024, env="ATTACHMENTS_MAX_BYTES")
+    attachments_max_total_bytes: int = Field(
+        2 * 1024**3, env="ATTACHMENTS_MAX_TOTAL_BYTES"
+    )
+    attachments_ttl_days: float = Field(30, env="ATTACHMENTS_TTL_DAYS")  # 0 = jamais
+
+    # Délais max des branches de récupération (secondes) ; au-delà, contexte vide
+    memory_timeout_s: float = Field(2.0, env="MEMORY_TIMEOUT_S")
+    docs_timeout_s: float = Field(5.0, env="DOCS_TIMEOUT_S")
+
+    # Pool Postgres du checkpointer LangGraph (ouvert pour toute la vie de l'app)
+    checkpoint_pool_min_size: int = Field(1, env="CHECKPOINT_POOL_MIN_SIZE")
+    checkpoint_pool_max_size: int = Field(10, env="CHECKPOINT_POOL_MAX_SIZE")
+    # Attente max d'une connexion libre (et de l'ouverture du pool), en secondes
+    checkpoint_pool_timeout_s: float = Field(10.0, env="CHECKPOINT_POOL_TIMEOUT_S")
+
+    # Gouverneur des services amont : appels simultanés max (0 = illimité),
+    # débit max en appels/s (0 = illimité)
+    openai_chat_concurrency: int = Field(16, env="OPENAI_CHAT_CONCURRENCY")
+    openai_chat_rps: float = Field(0, env="OPENAI_CHAT_RPS")
+    openai_embed_concurrency: int = Field(32, env="OPENAI_EMBED_CONCURRENCY")
+    openai_embed_rps: float = Field(0, env="OPENAI_EMBED_RPS")
+    zep_concurrency: int = Field(20, env="ZEP_CONCURRENCY")
+    qdrant_concurrency: int = Field(32, env="QDRANT_CONCURRENCY")
+    # File d'attente par service : au-delà, ou après le délai, rejet 503 + Retry-After
+    upstream_max_queue: int = Field(64, env="UPSTREAM_MAX_QUEUE")
+    upstream_queue_timeout_s: float = Field(5.0, env="UPSTREAM_QUEUE_TIMEOUT_S")
+    # Retries des erreurs transitoires (429, 5xx, réseau) : backoff exponentiel + jitter
+    upstream_max_retries: int = Field(3, env="UPSTREAM_MAX_RETRIES")
+    upstream_retry_base_s: float = Field(0.25, env="UPSTREAM_RETRY_BASE_S")
+    upstream_retry_max_s: float = Field(8.0, env="UPSTREAM_RETRY_MAX_S")
+
+    # Logs : niveau, format JSON, taille max d'un message, file d'écriture
+    log_level: str = Field("INFO", env="LOG_LEVEL")
+    log_json: bool = Field(False, env="LOG_JSON")
+    log_max_message_chars: int = Field(4000, env="LOG_MAX_MESSAGE_CHARS")  # 0 = illimité
+    log_queue_size: int = Field(10_000, env="LOG_QUEUE_SIZE")
+    # Log (WARNING) des requêtes plus lentes que ce seuil, avec le détail des
+    # spans (0 = désactivé)
+    slow_request_ms: int = Field(0, env="SLOW_REQUEST_MS")
+
+    # Démarrage : debugger VS Code (debugpy) sur demande seulement ; warmup =
+    # pool Postgres, Qdrant et Zep ouverts avant d'accepter le trafic (/ready)
+    debugpy_enabled: bool = Field(False, env="DEBUGPY_ENABLED")
+    debugpy_port: int = Field(5678, env="DEBUGPY_PORT")
+    startup_warmup: bool = Field(True, env="STARTUP_WARMUP")
+    startup_warmup_timeout_s: float = Field(10.0, env="STARTUP_WARMUP_TIMEOUT_S")
 
     # Projects registry (JSON)
     projects_file: str = Field("/data/projects.json", env="PROJECTS_FILE")
 
-settings = Settings()
+
+_settings: Optional[Settings] = None
+
+
+def get_settings() -> Settings:
+    """Settings lus (env, .env) au premier appel, pas à l'import."""
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
+
+
+class _LazySettings:
+    """
+    Mandataire de `settings` : importer un module ne lit ni ne valide
+    l'environnement, le premier attribut lu le fait.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+
+settings: Settings = _LazySettings()  # type: ignore[assignment]
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Emit = Callable[[Any], None]
+
+
+def normalize_question(text: str) -> str:
+    """Clé de regroupement : casse et espaces ignorés."""
+    return " ".join(text.casefold().split())
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        # Événements déjà émis (tokens), rejoués aux appelants arrivés en cours de route
+        self.events: List[Any] = []
+        self.subscribers: List[Emit] = []
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Regroupe les exécutions identiques en cours : le premier appelant d'une clé
+    lance fn, les suivants attendent le même résultat (ou la même exception).
+    - fn(emit) peut publier des événements (tokens du LLM) : ils sont diffusés
+      à tous les appelants, y compris ceux arrivés après le début
+    - fn tourne dans sa propre tâche : un appelant annulé (client déconnecté,
+      timeout de branche) ne l'interrompt pas tant qu'il reste un appelant ;
+      le dernier à partir l'annule
+    - la clé est libérée dès la fin de fn : rien n'est mis en cache ici
+
+        flights = SingleFlight()
+        answer = await flights.run(key, lambda emit: produce(emit), on_event=writer)
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def run(
+        self,
+        key: Hashable,
+        fn: Callable[[Emit], Awaitable[T]],
+        on_event: Optional[Emit] = None,
+    ) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(fn(self._emitter(flight)))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            if on_event is not None:
+                for event in flight.events:
+                    on_event(event)
+        if on_event is not None:
+            flight.subscribers.append(on_event)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if on_event is not None:
+                flight.subscribers.remove(on_event)
+            if flight.waiters == 0 and not flight.task.done():
+                # Clé libérée avant l'annulation : un appelant arrivé avant le
+                # done-callback lance une nouvelle exécution au lieu de
+                # rejoindre une tâche annulée
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    @staticmethod
+    def _emitter(flight: _Flight) -> Emit:
+        def emit(event: Any):
+            flight.events.append(event)
+            for subscriber in list(flight.subscribers):
+                try:
+                    subscriber(event)
+                except Exception as e:
+                    # Un appelant en erreur ne doit pas interrompre les autres
+                    log.warning("Diffusion single-flight ignorée: %s", e)
+
+        return emit
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
+
+
+_flights: Optional[SingleFlight] = None
+
+
+def get_singleflight() -> Optional[SingleFlight]:
+    """Regroupement partagé du process ; None si SINGLEFLIGHT_ENABLED est désactivé."""
+    global _flights
+    if not settings.singleflight_enabled:
+        return None
+    if _flights is None:
+        _flights = SingleFlight()
+    return _flights
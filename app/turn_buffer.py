@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional
+
+from settings import settings
+
+
+@dataclass
+class _Session:
+    lines: Deque[str]
+    # complete : le buffer contient tout l'historique de la session (créée par
+    # ce process) ; sinon des tours plus anciens n'existent que dans Zep
+    complete: bool
+    size: int = 0
+    # Messages ajoutés depuis l'amorçage, y compris ceux sortis du deque
+    count: int = 0
+
+
+class RecentTurnsBuffer:
+    """
+    Derniers messages de chaque session, gardés en mémoire du process.
+    - alimenté à l'écriture (node_answer) : lecture immédiate de ses propres
+      écritures, même si l'écriture Zep est encore en file
+    - borné en messages par session, en nombre de sessions et en octets
+      (LRU : les sessions les moins récemment utilisées sont évincées)
+    - recent() dit si le buffer suffit ; sinon l'appelant interroge Zep et
+      peut l'amorcer avec le résultat (seed)
+    - has_older() dit si un historique plus ancien existe, à chercher dans Zep
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        per_session: int = 20,
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.per_session = per_session
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, session_id: str, complete: bool) -> _Session:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = _Session(
+                deque(maxlen=self.per_session), complete
+            )
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _push(self, entry: _Session, lines: Iterable[str]):
+        for line in lines:
+            if len(entry.lines) == entry.lines.maxlen:
+                dropped = len(entry.lines[0].encode("utf-8"))
+                entry.size -= dropped
+                self._bytes -= dropped
+            n = len(line.encode("utf-8"))
+            entry.lines.append(line)
+            entry.count += 1
+            entry.size += n
+            self._bytes += n
+
+    def _evict(self):
+        while self._sessions and (
+            len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            _, entry = self._sessions.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def start(self, session_id: str):
+        """Session nouvellement créée : aucun historique ailleurs que dans le buffer."""
+        with self._lock:
+            self._entry(session_id, complete=True)
+            self._evict()
+
+    def append(self, session_id: str, lines: List[str]):
+        with self._lock:
+            # Session inconnue (redémarrage, éviction) : historique partiel
+            self._push(self._entry(session_id, complete=False), lines)
+            self._evict()
+
+    def seed(self, session_id: str, lines: List[str], complete: bool = False):
+        """
+        Amorce une session absente à partir des messages lus dans Zep ;
+        complete=True si Zep a renvoyé tout l'historique de la session.
+        """
+        with self._lock:
+            if session_id not in self._sessions:
+                self._push(self._entry(session_id, complete=complete), lines)
+                self._evict()
+
+    def recent(self, session_id: str, limit: int) -> Optional[List[str]]:
+        """
+        Les `limit` derniers messages si le buffer suffit à les fournir : session
+        complète, ou au moins `limit` messages en mémoire. None sinon.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or (not entry.complete and len(entry.lines) < limit):
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return list(entry.lines)[-limit:] if limit > 0 else []
+
+    def has_older(self, session_id: str, limit: int) -> bool:
+        """
+        True si la session a des messages plus anciens que ses `limit` derniers :
+        historique partiel (le reste est dans Zep) ou plus long que `limit`.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry is None or not entry.complete or entry.count > limit
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_buffer: Optional[RecentTurnsBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_turn_buffer() -> Optional[RecentTurnsBuffer]:
+    """Buffer partagé du process ; None si TURN_BUFFER_SESSIONS vaut 0."""
+    global _buffer
+    if settings.turn_buffer_sessions <= 0:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = RecentTurnsBuffer(
+                max_sessions=settings.turn_buffer_sessions,
+                max_bytes=settings.turn_buffer_max_bytes,
+                per_session=settings.turn_buffer_messages,
+            )
+        return _buffer
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Modules de app/ importés à plat, comme dans le conteneur (WORKDIR /app)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("APP_API_KEY", "test")
+os.environ.setdefault("LOG_DIR", "/tmp/rag-tests-logs")
@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace as NS
+
+import graph
+from langgraph.checkpoint.memory import InMemorySaver
+from retriever import DocHit
+
+
+class FakeMemory:
+    def __init__(self, session_id, project):
+        self.session_id = f"{project}::{session_id}"
+
+    async def recent_messages(self, limit=6):
+        return []
+
+    async def add_messages(self, messages):
+        pass
+
+
+class FakeRetriever:
+    async def asearch_hits(self, queries, top_k=4, project=None, **kwargs):
+        return [DocHit("doc-1", "[a.md] passage", 0.9)]
+
+
+async def _fake_aembed(texts, cache=False):
+    return [[1.0, 0.0] for _ in texts]
+
+
+def _user(text):
+    return {"role": "user", "content": [{"type": "text", "text": text}]}
+
+
+def _state(text):
+    return {
+        "session_id": "s",
+        "project": "default",
+        "question": None,
+        "messages": [_user(text)],
+        "contexts": {},
+        "doc_ids": [],
+        "answer": "",
+        "cached": False,
+    }
+
+
+def test_retry_after_failed_run_does_not_duplicate_user_message(monkeypatch):
+    failures = [RuntimeError("upstream down")]
+
+    async def create(**kwargs):
+        if failures:
+            raise failures.pop()
+
+        async def gen():
+            yield NS(choices=[NS(delta=NS(content="ok"))], usage=None)
+
+        return gen()
+
+    monkeypatch.setattr(graph, "AsyncZepMemory", FakeMemory)
+    monkeypatch.setattr(graph, "docs_retriever", FakeRetriever())
+    monkeypatch.setattr(graph, "aembed", _fake_aembed)
+    monkeypatch.setattr(graph, "get_answer_cache", lambda: None)
+    monkeypatch.setattr(graph, "get_turn_buffer", lambda: None)
+    monkeypatch.setattr(graph, "get_memory_queue", lambda: None)
+    monkeypatch.setattr(graph, "_client", NS(chat=NS(completions=NS(create=create))))
+    app = graph.build_graph(InMemorySaver())
+    config = {"configurable": {"thread_id": "t"}}
+
+    async def scenario():
+        try:
+            await app.ainvoke(_state("bonjour"), config)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("le premier tour devait échouer")
+        await app.ainvoke(_state("bonjour"), config)
+        await app.ainvoke(_state("et ensuite ?"), config)
+        return (await app.aget_state(config)).values["messages"]
+
+    messages = asyncio.run(scenario())
+    assert [m["role"] for m in messages] == ["user", "assistant"] * 2
+    assert messages[0] == _user("bonjour")
+    assert messages[2] == _user("et ensuite ?")
+
+
+def test_reducer_replaces_unanswered_user_message():
+    history = [_user("a"), {"role": "assistant", "content": "b"}, _user("c")]
+    merged = graph.append_messages(history, [_user("c")])
+    assert merged == [_user("a"), {"role": "assistant", "content": "b"}, _user("c")]
@@ -0,0 +1,34 @@
+from chunking import _tokens, chunk_text
+
+
+def _paragraphs(n: int, words: int) -> str:
+    return "\n\n".join(" ".join(f"mot{p}_{w}" for w in range(words)) for p in range(n))
+
+
+def _assert_overlapping(text, chunks, max_tokens):
+    assert len(chunks) > 1
+    for c in chunks:
+        assert text[c.start : c.end] == c.text
+        assert _tokens(c.text) <= max_tokens
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt.start < prev.end
+        assert nxt.end > prev.end
+
+
+def test_long_paragraphs_overlap():
+    text = _paragraphs(6, 120)
+    chunks = chunk_text(text, ".txt", max_tokens=80, overlap_tokens=20)
+    _assert_overlapping(text, chunks, 80)
+
+
+def test_oversized_line_pieces_overlap():
+    text = " ".join(f"token{i}" for i in range(800))
+    chunks = chunk_text(text, ".md", max_tokens=60, overlap_tokens=15)
+    _assert_overlapping(text, chunks, 60)
+
+
+def test_no_overlap_when_disabled():
+    text = _paragraphs(4, 120)
+    chunks = chunk_text(text, ".txt", max_tokens=80, overlap_tokens=0)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt.start >= prev.end
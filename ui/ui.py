@@ -20,6 +20,32 @@ def api_get(path: str):
 def api_post(path: str, json_body: dict):
     return requests.post(f"{APP_URL}{path}", json=json_body, headers={"x-api-key": API_KEY})
 
+def api_upload(file) -> str:
+    """Téléverse une image une seule fois ; le message ne porte que sa référence (sha256)."""
+    r = requests.post(f"{APP_URL}/attachments", data=file.getvalue(),
+                      headers={"x-api-key": API_KEY, "content-type": file.type or "image/png"})
+    r.raise_for_status()
+    return r.json()["id"]
+
+def api_stream(path: str, json_body: dict, final: Dict[str, Any]):
+    """Consomme un flux SSE : rend les tokens au fil de l'eau, range done/error dans final."""
+    with requests.post(f"{APP_URL}{path}", json=json_body, headers={"x-api-key": API_KEY}, stream=True) as r:
+        if not r.ok:
+            final["error"] = f"{r.status_code} {r.text}"
+            return
+        event = None
+        for line in r.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+                if event == "token":
+                    yield data["text"]
+                elif event == "done":
+                    final["answer"] = data["answer"]
+                elif event == "error":
+                    final["error"] = data["detail"]
+
 st.set_page_config(page_title="Local Chat – Projects", page_icon="📁", layout="wide")
 
 # ---- Sidebar: Projects management ----
@@ -108,28 +134,31 @@ prompt = st.chat_input("Écris ton message…")
 if prompt:
     user_parts = [{"type":"text","text":prompt}]
     for img in image_files or []:
-        user_parts.append({"type":"image","data_url": to_data_url(img)})
+        # data_url : affichage local uniquement ; ref : ce que reçoit le serveur
+        user_parts.append({"type":"image","ref": api_upload(img), "data_url": to_data_url(img)})
     st.session_state.history.append({"role":"user","content":user_parts})
 
     payload = {
         "session_id": "ui-session",
         "project": project,
         "thread_id": st.session_state["thread_id"],
-        "messages": st.session_state.history
+        # Seul le nouveau message part : l'historique est conservé côté serveur (checkpoint du thread)
+        "messages": [{"role": "user", "content": [
+            {k: v for k, v in p.items() if k != "data_url"} for p in user_parts
+        ]}]
     }
 
     # Afficher temporairement le thread_id et le payload
     st.write(f"Thread ID: {st.session_state['thread_id']}")
     st.write("Payload:", payload)
-    r = api_post("/chat", payload)
-    if not r.ok:
-        with st.chat_message("assistant"):
-            st.error(f"Erreur API: {r.status_code} {r.text}")
-    else:
-        answer = r.json().get("answer","")
-        st.session_state.history.append({"role":"assistant","content":[{"type":"text","text":answer}]})
-        with st.chat_message("assistant"):
-            st.markdown(answer)
+    final: Dict[str, Any] = {}
+    with st.chat_message("assistant"):
+        streamed = st.write_stream(api_stream("/chat/stream", payload, final))
+        if "error" in final:
+            st.error(f"Erreur API: {final['error']}")
+        else:
+            answer = final.get("answer") or streamed or ""
+            st.session_state.history.append({"role":"assistant","content":[{"type":"text","text":answer}]})
             for url in parse_markdown_images(answer):
                 st.image(url)
 